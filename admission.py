@@ -0,0 +1,116 @@
+"""
+Cache Admission Policy
+TinyLFU-style frequency filter deciding which responses are worth caching.
+Every lookup records its key; a response is admitted once its key has been
+seen k times, or when it was expensive enough to generate that even one
+repeat pays off. One-off prompts therefore never displace hot entries.
+
+A doorkeeper Bloom filter absorbs first sightings so the count-min sketch only
+tracks keys seen twice or more. Every sample period all counters are halved
+and the doorkeeper cleared, so frequencies age out.
+"""
+
+import hashlib
+import os
+from typing import Optional
+
+from app.services.bloom import BloomFilter
+
+CACHE_ADMISSION = os.getenv("CACHE_ADMISSION", "tinylfu")  # "tinylfu" | "always"
+CACHE_ADMIT_MIN_SEEN = int(os.getenv("CACHE_ADMIT_MIN_SEEN", "2"))  # k
+CACHE_ADMIT_COST_MS = float(os.getenv("CACHE_ADMIT_COST_MS", "5000"))  # admit slower generations outright
+SKETCH_WIDTH = int(os.getenv("CACHE_SKETCH_WIDTH", "65536"))  # counters per row
+SKETCH_DEPTH = 4
+SKETCH_SAMPLE = 10 * SKETCH_WIDTH  # recordings between agings
+
+_HALVE = bytes(v >> 1 for v in range(256))
+
+
+class FrequencySketch:
+    """Count-min sketch (saturating 8-bit counters) with a doorkeeper and aging."""
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH, sample: int = SKETCH_SAMPLE):
+        self._width = width
+        self._depth = depth
+        self._sample = sample
+        self._table = bytearray(width * depth)
+        self._doorkeeper = BloomFilter(sample, 0.01)
+        self._recorded = 0
+        self.resets = 0
+
+    def _slots(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [row * self._width + (h1 + row * h2) % self._width for row in range(self._depth)]
+
+    def record(self, key: str) -> None:
+        if key not in self._doorkeeper:
+            self._doorkeeper.add(key)
+        else:
+            for slot in self._slots(key):
+                if self._table[slot] < 255:
+                    self._table[slot] += 1
+        self._recorded += 1
+        if self._recorded >= self._sample:
+            self._age()
+
+    def estimate(self, key: str) -> int:
+        seen = min(self._table[slot] for slot in self._slots(key))
+        return seen + (1 if key in self._doorkeeper else 0)
+
+    def _age(self) -> None:
+        self._table = bytearray(self._table.translate(_HALVE))
+        self._doorkeeper = BloomFilter(self._sample, 0.01)
+        self._recorded = 0
+        self.resets += 1
+
+
+class AdmissionPolicy:
+    def __init__(
+        self,
+        mode: str = CACHE_ADMISSION,
+        min_seen: int = CACHE_ADMIT_MIN_SEEN,
+        cost_ms: float = CACHE_ADMIT_COST_MS,
+    ):
+        self._sketch = FrequencySketch() if mode == "tinylfu" else None
+        self._min_seen = min_seen
+        self._cost_ms = cost_ms
+        self.admitted_frequency = 0
+        self.admitted_cost = 0
+        self.admitted_forced = 0
+        self.rejected = 0
+
+    def record(self, key: str) -> None:
+        """Note a lookup for key (hit or miss)."""
+        if self._sketch is not None:
+            self._sketch.record(key)
+
+    def admit(self, key: str, cost_ms: Optional[float] = None, force: bool = False) -> bool:
+        if force:
+            self.admitted_forced += 1
+            return True
+        if self._sketch is None or self._sketch.estimate(key) >= self._min_seen:
+            self.admitted_frequency += 1
+            return True
+        if cost_ms is not None and cost_ms >= self._cost_ms:
+            self.admitted_cost += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def stats(self) -> dict:
+        admitted = self.admitted_frequency + self.admitted_cost + self.admitted_forced
+        decisions = admitted + self.rejected
+        return {
+            "mode": "tinylfu" if self._sketch is not None else "always",
+            "min_seen": self._min_seen,
+            "cost_ms": self._cost_ms,
+            "admitted": admitted,
+            "admitted_frequency": self.admitted_frequency,
+            "admitted_cost": self.admitted_cost,
+            "admitted_forced": self.admitted_forced,
+            "rejected": self.rejected,
+            "admit_ratio": round(admitted / decisions, 4) if decisions else 0.0,
+            "sketch_resets": self._sketch.resets if self._sketch is not None else 0,
+        }
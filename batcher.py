@@ -0,0 +1,90 @@
+"""
+Micro-Batching Service
+Collects concurrent non-streaming completions that share a model and sampling
+params over a short window, then sends them upstream as one batched request.
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+BATCH_WINDOW_MS = float(os.getenv("VLLM_BATCH_WINDOW_MS", "0"))  # 0 = batching disabled
+BATCH_MAX_SIZE = int(os.getenv("VLLM_BATCH_MAX_SIZE", "32"))     # flush early when full
+
+BatchKey = Tuple[str, int, float]  # (model, max_tokens, temperature)
+SendBatch = Callable[[str, List[str], int, float], Awaitable[List[str]]]
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        send_batch: SendBatch,
+        window_ms: float = BATCH_WINDOW_MS,
+        max_size: int = BATCH_MAX_SIZE,
+    ):
+        self._send_batch = send_batch
+        self._window = window_ms / 1000
+        self._max_size = max_size
+        self._pending: Dict[BatchKey, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[BatchKey, asyncio.TimerHandle] = {}
+        self._dispatching: Set[asyncio.Task] = set()
+        self._batches = 0
+        self._requests = 0
+
+    async def submit(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+    ) -> str:
+        """Queue one prompt and wait for its slice of the batched response."""
+        loop = asyncio.get_running_loop()
+        key = (model, max_tokens, temperature)
+        future = loop.create_future()
+
+        batch = self._pending.setdefault(key, [])
+        batch.append((prompt, future))
+        if len(batch) >= self._max_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self._window, self._flush, key)
+
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "batches": self._batches,
+            "requests": self._requests,
+            "avg_batch_size": round(self._requests / self._batches, 2) if self._batches else 0.0,
+            "pending": sum(len(b) for b in self._pending.values()),
+        }
+
+    def _flush(self, key: BatchKey) -> None:
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._dispatch(key, batch))
+        self._dispatching.add(task)  # Keep a reference until it finishes
+        task.add_done_callback(self._dispatching.discard)
+
+    async def _dispatch(self, key: BatchKey, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        model, max_tokens, temperature = key
+        self._batches += 1
+        self._requests += len(batch)
+        try:
+            texts = await self._send_batch(
+                model, [prompt for prompt, _ in batch], max_tokens, temperature
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), text in zip(batch, texts):
+            if not future.done():  # Caller may have been cancelled meanwhile
+                future.set_result(text)
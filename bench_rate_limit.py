@@ -0,0 +1,105 @@
+"""
+Rate Limiter Benchmark
+Compares the sliding-window (ZSET) and GCRA limiter scripts on a real Redis:
+per-check latency and Redis memory per tracked user.
+
+    REDIS_URL=redis://localhost:6379 python bench_rate_limit.py --users 10000 --requests 30
+
+Uses its own key prefix and deletes its keys afterwards. Don't point it at a
+Redis that's under production load — memory deltas come from INFO.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+
+import redis.asyncio as redis
+
+from app.middleware.rate_limit import GCRA_LUA, RATE_LIMIT, SLIDING_WINDOW_LUA, WINDOW_SECS
+
+PREFIX = "bench_rate_limit"
+
+
+def _args(mode: str, now_ms: int, burst: int) -> list:
+    if mode == "gcra":
+        return [now_ms, WINDOW_SECS * 1000 / RATE_LIMIT, burst]
+    return [now_ms, WINDOW_SECS * 1000, RATE_LIMIT, f"{now_ms}-{uuid.uuid4().hex[:12]}"]
+
+
+async def _run(client, mode: str, users: int, requests: int, burst: int, concurrency: int) -> dict:
+    lua = GCRA_LUA if mode == "gcra" else SLIDING_WINDOW_LUA
+    script = client.register_script(lua)
+    await client.script_load(lua)  # Keep the first NOSCRIPT out of the latencies
+    before = (await client.info("memory"))["used_memory"]
+    latencies = []
+    allowed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(user: int) -> None:
+        nonlocal allowed
+        async with semaphore:
+            start = time.perf_counter()
+            reply = await script(
+                keys=[f"{PREFIX}:{mode}:{user}"],
+                args=_args(mode, int(time.time() * 1000), burst),
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            allowed += int(reply[0])
+
+    started = time.perf_counter()
+    # Round-robin over users, so each user's requests are spread across the run
+    for _ in range(requests):
+        await asyncio.gather(*(check(u) for u in range(users)))
+    elapsed = time.perf_counter() - started
+
+    after = (await client.info("memory"))["used_memory"]
+    sample = [f"{PREFIX}:{mode}:{u}" for u in range(min(users, 100))]
+    key_bytes = [await client.memory_usage(k) or 0 for k in sample]
+    latencies.sort()
+    return {
+        "mode": mode,
+        "checks": len(latencies),
+        "allowed": allowed,
+        "throughput_per_s": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3),
+        "memory_delta_bytes": after - before,
+        "bytes_per_user": round((after - before) / users),
+        "memory_usage_per_key": round(statistics.mean(key_bytes)),
+    }
+
+
+async def _cleanup(client) -> None:
+    async for key in client.scan_iter(match=f"{PREFIX}:*", count=1000):
+        await client.unlink(key)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=30, help="requests per user")
+    parser.add_argument("--burst", type=int, default=RATE_LIMIT, help="GCRA burst allowance")
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+    try:
+        await _cleanup(client)
+        results = []
+        for mode in ("sliding", "gcra"):
+            results.append(await _run(client, mode, args.users, args.requests, args.burst, args.concurrency))
+            await _cleanup(client)
+    finally:
+        await client.aclose()
+
+    columns = list(results[0])
+    print(" | ".join(f"{c:>20}" for c in columns))
+    for row in results:
+        print(" | ".join(f"{str(row[c]):>20}" for c in columns))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""
+Cache Membership Filter
+In-process Bloom filter over cached keys, so lookups for keys that are
+definitely not in Redis skip the round trip. Bits can't be deleted, so the
+filter rotates through two generations every max TTL (a key lives for at
+least one full rotation) and is periodically rebuilt from a Redis SCAN.
+False positives only cost the GET we'd have made anyway.
+"""
+
+import hashlib
+import math
+import os
+import time
+from typing import Optional
+
+BLOOM_CAPACITY = int(os.getenv("CACHE_BLOOM_CAPACITY", "1000000"))  # keys per generation
+BLOOM_ERROR_RATE = float(os.getenv("CACHE_BLOOM_ERROR_RATE", "0.01"))
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0  # Adds, including repeats — an upper bound on members
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def fill_ratio(self) -> float:
+        """Expected share of set bits (estimated — counting 1 MB of bits is slow)."""
+        return 1 - math.exp(-self.hashes * self.count / self.size)
+
+
+class RotatingBloomFilter:
+    """
+    Two generations: adds go to the current one, lookups check both. Every
+    `rotate_every` seconds the previous generation is dropped, so entries
+    expire without per-key bookkeeping. Until the first rebuild finishes the
+    filter isn't ready and answers "maybe" for everything.
+    """
+
+    def __init__(
+        self,
+        rotate_every: float,
+        capacity: int = BLOOM_CAPACITY,
+        error_rate: float = BLOOM_ERROR_RATE,
+    ):
+        self._rotate_every = rotate_every
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+        self._rotated_at = time.monotonic()
+        self._building: Optional[BloomFilter] = None
+        self._building_since = 0.0
+        self.ready = False
+        self.rotations = 0
+        self.rebuilds = 0
+
+    def add(self, key: str) -> None:
+        self._maybe_rotate()
+        self._current.add(key)
+        if self._building is not None:
+            self._building.add(key)  # Don't lose keys written mid-rebuild
+
+    def might_contain(self, key: str) -> bool:
+        if not self.ready:
+            return True
+        self._maybe_rotate()
+        return key in self._current or (self._previous is not None and key in self._previous)
+
+    def begin_rebuild(self) -> BloomFilter:
+        self._building = BloomFilter(self._capacity, self._error_rate)
+        self._building_since = time.monotonic()
+        return self._building
+
+    def finish_rebuild(self, fresh: BloomFilter) -> None:
+        if fresh is not self._building:
+            return  # Superseded by a newer rebuild
+        self._current, self._previous = fresh, None
+        self._rotated_at = self._building_since
+        self._building = None
+        self.ready = True
+        self.rebuilds += 1
+
+    def abort_rebuild(self) -> None:
+        self._building = None
+
+    def _maybe_rotate(self) -> None:
+        now = time.monotonic()
+        if now - self._rotated_at < self._rotate_every:
+            return
+        self._previous = self._current
+        self._current = BloomFilter(self._capacity, self._error_rate)
+        self._rotated_at = now
+        self.rotations += 1
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "keys_current": self._current.count,
+            "keys_previous": self._previous.count if self._previous else 0,
+            "fill_ratio": round(self._current.fill_ratio(), 4),
+            "hashes": self._current.hashes,
+            "bytes": len(self._current._bits) * 2,
+            "rotations": self.rotations,
+            "rebuilds": self.rebuilds,
+        }
@@ -1,51 +1,527 @@
 """
 Semantic Cache Service
 Caches AI responses in Redis to avoid redundant (expensive) inference calls.
-Simple exact-match cache — upgrade to vector similarity cache for production.
+Keys cover the prompt, the model and the sampling params that change the
+output, namespaced per model with per-model TTLs. Exact-match by default;
+CACHE_MODE=semantic adds vector-similarity lookups so differently-phrased
+prompts can hit too.
+A bounded in-process L1 tier answers the hottest prompts without a round trip.
+Large values are compressed before they reach Redis (see codec.py), and a
+local Bloom filter lets definite misses skip Redis altogether. A frequency
+based admission policy keeps one-off responses out (see admission.py).
+Concurrent reads/writes are coalesced into MGET / pipelined SET batches.
 """
 
+import asyncio
 import hashlib
 import json
-from typing import Optional
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Optional, Tuple
 
+from app.services.admission import AdmissionPolicy
+from app.services.bloom import RotatingBloomFilter
+from app.services.codec import ValueCodec
+from app.services.deadline import Deadline
+from app.services.local_cache import LocalCache
+from app.services.redis_batcher import RedisBatcher
 from app.services.redis_client import redis_client
 
-CACHE_TTL = 3600  # 1 hour
+if TYPE_CHECKING:  # NumPy is only imported when semantic mode is on
+    from app.services.vector_index import VectorIndex
+
+CACHE_TTL = 3600  # 1 hour — default for models without their own policy
+# Past this fraction of its TTL an entry is stale: still served, but refreshed
+CACHE_SOFT_TTL_RATIO = float(os.getenv("CACHE_SOFT_TTL_RATIO", "0.8"))
+LEGACY_L1_TTL = 60  # Pre-envelope entries carry no expiry — keep them in L1 briefly
+CACHE_MODE = os.getenv("CACHE_MODE", "exact")  # "exact" | "semantic"
+# Tuned for text-embedding-3-small: paraphrases score above it, while prompts
+# that differ in one meaningful word ("safe" / "unsafe") fall below
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95"))
+CACHE_EMBEDDER = os.getenv("CACHE_EMBEDDER", "openai")  # "openai" | "hash" (tests only)
+# The hashing embedder scores surface overlap, not meaning ("Austria" vs
+# "Australia" match), so semantic mode refuses it unless this is set
+CACHE_ALLOW_HASH_EMBEDDER = os.getenv("CACHE_ALLOW_HASH_EMBEDDER", "0") == "1"
+
+# Pub/sub — keeps replicas' local state (L1 tier, vector index) in sync
+INVALIDATE_CHANNEL = "ai_cache:invalidate"
+ADDED_CHANNEL = "ai_cache:added"
+VECTOR_PREFIX = "ai_vec:"  # Persisted embeddings, one per cache entry, same TTL
+REFRESH_LOCK_PREFIX = "ai_refresh:"
+REFRESH_LOCK_MS = 30_000
+CACHE_BLOOM = os.getenv("CACHE_BLOOM", "1") == "1"
+CACHE_BLOOM_SYNC_INTERVAL = float(os.getenv("CACHE_BLOOM_SYNC_INTERVAL", "900"))  # full SCAN resync
+
+
+class CacheEntry(NamedTuple):
+    value: str
+    stale: bool = False  # Past the soft TTL — serve, but refresh in the background
+
+
+def _decode(raw: Any) -> Tuple[str, float, float]:
+    """
+    Stored value -> (response, soft expiry, hard expiry) as epoch seconds.
+    Values are {"r": response, "s": soft, "h": hard}; bare JSON strings from
+    before soft TTLs existed are treated as fresh.
+    """
+    data = json.loads(raw)
+    if isinstance(data, dict) and "r" in data:
+        return data["r"], data["s"], data["h"]
+    now = time.time()
+    return data, now + LEGACY_L1_TTL, now + LEGACY_L1_TTL
+
+
+def _l1_size(response: str) -> int:
+    """L1 holds the decoded response, not the (compressed) Redis payload — size it by that."""
+    return len(response.encode())
+
+
+def _parse_ttls(spec: str) -> Dict[str, int]:
+    """Parse "gpt-4o=7200,gpt-4o-mini=600" into {model: seconds}."""
+    ttls = {}
+    for item in spec.split(","):
+        model, _, seconds = item.strip().rpartition("=")
+        if model and seconds:
+            ttls[model] = int(seconds)
+    return ttls
+
+
+# Per-model TTL policy; 0 turns caching off for that model
+CACHE_MODEL_TTLS = _parse_ttls(os.getenv("CACHE_MODEL_TTLS", ""))
+
+
+def ttl_for(model: str) -> int:
+    return CACHE_MODEL_TTLS.get(model, CACHE_TTL)
+
+
+def max_ttl() -> int:
+    return max([CACHE_TTL, *CACHE_MODEL_TTLS.values()])
+
+
+def _namespace(model: str) -> str:
+    """Model name made safe for use as a key segment."""
+    return re.sub(r"[^A-Za-z0-9._/-]", "_", model)
 
 
 class SemanticCache:
-    def _key(self, prompt: str) -> str:
-        """SHA-256 hash of the prompt as the cache key."""
+    def __init__(self, mode: str = CACHE_MODE, embedder=None):
+        self._l1 = LocalCache()
+        self._codec = ValueCodec()
+        self._admission = AdmissionPolicy()
+        self._redis = RedisBatcher()
+        self._listener: Optional[asyncio.Task] = None
+        self._background = set()
+        self._l1_hits = 0
+        self._l2_hits = 0
+        self._similar_hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+
+        # Membership filter — rotates every max TTL so no live key falls out
+        self._bloom = RotatingBloomFilter(max_ttl()) if CACHE_BLOOM else None
+        self._bloom_resync = asyncio.Event()
+        self._bloom_skips = 0
+        self._bloom_false_positives = 0
+
+        # Vector-similarity mode — NumPy is only needed when it's switched on.
+        # One index per (model, params) partition so matches never cross them.
+        self._semantic = mode == "semantic"
+        self._indexes: Dict[str, "VectorIndex"] = {}
+        self._embedder = None
+        if self._semantic:
+            from app.services.vector_index import HashingEmbedder, OpenAIEmbedder
+
+            if embedder is None:
+                if CACHE_EMBEDDER == "openai":
+                    from openai import AsyncOpenAI
+                    embedder = OpenAIEmbedder(AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY", "")))
+                elif CACHE_EMBEDDER == "hash" and CACHE_ALLOW_HASH_EMBEDDER:
+                    embedder = HashingEmbedder()
+                elif CACHE_EMBEDDER == "hash":
+                    raise ValueError(
+                        "CACHE_EMBEDDER=hash would serve wrong answers in semantic mode; "
+                        "set CACHE_ALLOW_HASH_EMBEDDER=1 to use it in tests"
+                    )
+                else:
+                    raise ValueError(f"Unknown CACHE_EMBEDDER: {CACHE_EMBEDDER}")
+            self._embedder = embedder
+
+    def _key(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        path: str = "chat",
+    ) -> str:
+        """
+        ai_cache:<model>:<params digest>:<prompt digest>.
+        The params digest is SHA-256 over a canonical JSON encoding of everything
+        besides the prompt that changes the output — including the generation
+        path, since batched answers skip the chat template. Chat keys leave the
+        path out, so entries written before it existed still match.
+        """
+        params = {"model": model, "max_tokens": int(max_tokens), "temperature": round(float(temperature), 4)}
+        if path != "chat":
+            params["path"] = path
+        params = json.dumps(params, sort_keys=True, separators=(",", ":"))
+        p = hashlib.sha256(params.encode()).hexdigest()[:16]
         h = hashlib.sha256(prompt.strip().lower().encode()).hexdigest()
-        return f"ai_cache:{h}"
+        return f"ai_cache:{_namespace(model)}:{p}:{h}"
 
-    async def get(self, prompt: str) -> Optional[str]:
-        try:
-            val = await redis_client.client.get(self._key(prompt))
-            return json.loads(val) if val else None
-        except Exception:
-            return None  # Cache miss on error — fail open
+    @staticmethod
+    def _vector_key(key: str) -> str:
+        return VECTOR_PREFIX + key.split(":", 1)[1]
+
+    @staticmethod
+    def _partition(key: str) -> str:
+        """Everything but the prompt digest — entries that may answer each other."""
+        return key.rsplit(":", 1)[0]
+
+    async def get(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        deadline: Optional[Deadline] = None,
+        path: str = "chat",
+    ) -> Optional[str]:
+        entry = await self.lookup(prompt, model, max_tokens, temperature, deadline, path)
+        return entry.value if entry else None
+
+    async def lookup(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        deadline: Optional[Deadline] = None,
+        path: str = "chat",
+    ) -> Optional[CacheEntry]:
+        """Like get(), but also says whether the entry is past its soft TTL."""
+        if ttl_for(model) <= 0:
+            return None  # Caching disabled for this model
+        key = self._key(prompt, model, max_tokens, temperature, path)
+        self._admission.record(key)
+        entry, tier = await self._lookup(key, deadline)
+        if entry is None and self._semantic:
+            entry = await self._lookup_similar(key, prompt, deadline)
+            tier = "similar" if entry is not None else None
+
+        if tier == "l1":
+            self._l1_hits += 1
+        elif tier == "l2":
+            self._l2_hits += 1
+        elif tier == "similar":
+            self._similar_hits += 1
+        else:
+            self._misses += 1
+        if entry and entry.stale:
+            self._stale_hits += 1
+        return entry
 
-    async def set(self, prompt: str, response: str) -> None:
+    async def set(
+        self,
+        prompt: str,
+        response: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        cost_ms: Optional[float] = None,
+        force: bool = False,
+        path: str = "chat",
+    ) -> None:
+        """
+        Store a response, subject to the admission policy. cost_ms is how long
+        it took to generate; force skips the policy (e.g. for warmup); path is
+        the generation path that produced it.
+        """
+        ttl = ttl_for(model)
+        if ttl <= 0:
+            return
+        key = self._key(prompt, model, max_tokens, temperature, path)
+        if not self._admission.admit(key, cost_ms, force):
+            return
+        now = time.time()
+        soft_at = now + ttl * CACHE_SOFT_TTL_RATIO
+        value = self._codec.encode(json.dumps({"r": response, "s": soft_at, "h": now + ttl}))
+        self._l1.set(key, (response, soft_at), ttl, _l1_size(response))
+        if self._bloom is not None:
+            self._bloom.add(key)
         try:
-            await redis_client.client.set(
-                self._key(prompt),
-                json.dumps(response),
-                ex=CACHE_TTL,
+            if not self._semantic:
+                # Other replicas' Bloom filters learn the key from the publish
+                publish = (ADDED_CHANNEL, key) if self._bloom is not None else None
+                await self._redis.set((key, value, ttl), publish=publish)
+                return
+            vector = await self._embedder.embed(prompt)
+            self._add_vector(key, vector, ttl)
+            await self._redis.set(
+                (key, value, ttl),
+                (self._vector_key(key), vector.tobytes(), ttl),
+                publish=(ADDED_CHANNEL, key),
             )
         except Exception:
             pass  # Non-critical — just skip caching
 
-    async def invalidate(self, prompt: str) -> None:
+    async def invalidate(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        path: str = "chat",
+    ) -> None:
+        key = self._key(prompt, model, max_tokens, temperature, path)
+        self._forget(key)
         try:
-            await redis_client.client.delete(self._key(prompt))
+            pipe = redis_client.client.pipeline(transaction=False)
+            pipe.delete(key, self._vector_key(key))
+            pipe.publish(INVALIDATE_CHANNEL, key)
+            await pipe.execute()
         except Exception:
             pass
 
+    async def claim_refresh(self, key: str) -> bool:
+        """Cluster-wide lock so only one replica regenerates a stale entry."""
+        try:
+            return bool(await redis_client.client.set(
+                REFRESH_LOCK_PREFIX + key, 1, nx=True, px=REFRESH_LOCK_MS
+            ))
+        except Exception:
+            return True  # Fail open — a duplicate refresh is harmless
+
+    async def reload(self, key: str, hold_stale: bool = False) -> bool:
+        """
+        Re-read an entry from Redis into L1, replacing this replica's copy.
+        True if Redis already has a fresh one (another replica refreshed it).
+        With hold_stale, a still-stale copy is served as fresh for the refresh
+        lock's duration, so hits stop re-claiming a refresh someone else holds.
+        """
+        try:
+            val = await self._redis.get(key)
+            if not val:
+                return False
+            response, soft_at, hard_at = _decode(self._codec.decode(val))
+        except Exception:
+            return False
+        now = time.time()
+        if now < soft_at:
+            self._l1.set(key, (response, soft_at), hard_at - now, _l1_size(response))
+            return True
+        if hold_stale:
+            hold = min(REFRESH_LOCK_MS / 1000, hard_at - now)
+            self._l1.set(key, (response, now + hold), hold, _l1_size(response))
+        return False
+
+    async def _lookup(
+        self, key: str, deadline: Optional[Deadline]
+    ) -> Tuple[Optional[CacheEntry], Optional[str]]:
+        """Exact-key lookup through L1 then Redis. Returns (entry, tier)."""
+        cached = self._l1.get(key)
+        if cached is not None:
+            response, soft_at = cached
+            return CacheEntry(response, time.time() >= soft_at), "l1"
+        if self._bloom is not None and not self._bloom.might_contain(key):
+            self._bloom_skips += 1
+            return None, None  # Definitely not in Redis
+
+        try:
+            lookup = self._redis.get(key)  # Batched into one MGET per tick
+            val = await (deadline.run(lookup, "cache lookup") if deadline else lookup)
+        except Exception:
+            return None, None  # Cache miss on error — fail open
+
+        if not val:
+            if self._bloom is not None and self._bloom.ready:
+                self._bloom_false_positives += 1
+            return None, None
+        try:
+            response, soft_at, hard_at = _decode(self._codec.decode(val))
+        except Exception:
+            return None, None  # e.g. written with a dictionary this replica lacks
+        now = time.time()
+        # The L1 copy expires with the Redis one
+        self._l1.set(key, (response, soft_at), hard_at - now, _l1_size(response))
+        return CacheEntry(response, now >= soft_at), "l2"
+
+    async def _lookup_similar(
+        self, key: str, prompt: str, deadline: Optional[Deadline]
+    ) -> Optional[CacheEntry]:
+        index = self._indexes.get(self._partition(key))
+        if index is None:
+            return None
+        try:
+            vector = await self._embedder.embed(prompt)
+        except Exception:
+            return None
+        match = index.search(vector)
+        if not match or match[1] < CACHE_SIMILARITY_THRESHOLD:
+            return None
+        entry, _ = await self._lookup(match[0], deadline)
+        if entry is None:
+            index.remove(match[0])  # Payload expired or was invalidated elsewhere
+            return None
+        # Refreshing would regenerate *this* prompt, not the neighbour's — don't
+        return CacheEntry(entry.value, stale=False)
+
+    def _add_vector(self, key: str, vector, ttl: float) -> None:
+        from app.services.vector_index import VectorIndex
+
+        partition = self._partition(key)
+        index = self._indexes.get(partition)
+        if index is None:
+            index = self._indexes[partition] = VectorIndex(self._embedder.dim)
+        index.add(key, vector, ttl)
+        if index.needs_training():
+            self._spawn(index.train())
+
+    def _has_vector(self, key: str) -> bool:
+        index = self._indexes.get(self._partition(key))
+        return index is not None and key in index
+
+    def _forget(self, key: str) -> None:
+        self._l1.delete(key)
+        index = self._indexes.get(self._partition(key))
+        if index is not None:
+            index.remove(key)
+
+    # --- Replica sync: invalidations, new vectors, index rebuild ---
+
+    async def start(self) -> None:
+        """Subscribe to other replicas' changes and rebuild local state (call at startup)."""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+            if self._semantic:
+                self._spawn(self._rebuild_index())
+            if self._bloom is not None:
+                self._spawn(self._sync_bloom_loop())
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._listener, *self._background] if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._listener = None
+        await self._redis.close()
+
+    async def _listen(self) -> None:
+        listen_added = self._semantic or self._bloom is not None
+        channels = [INVALIDATE_CHANNEL] + ([ADDED_CHANNEL] if listen_added else [])
+        while True:
+            try:
+                pubsub = redis_client.client.pubsub()
+                await pubsub.subscribe(*channels)
+                # Anything published while we weren't subscribed is lost
+                self._l1.clear()
+                if self._bloom is not None:
+                    self._bloom.ready = False  # May have missed adds — resync
+                    self._bloom_resync.set()
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        channel, key = (
+                            v.decode() if isinstance(v, bytes) else v
+                            for v in (message["channel"], message["data"])
+                        )
+                        if channel == INVALIDATE_CHANNEL:
+                            self._forget(key)  # Bloom bits stay until rotation/resync
+                            continue
+                        if self._bloom is not None:
+                            self._bloom.add(key)
+                        if self._semantic and not self._has_vector(key):
+                            await self._load_vectors([key])
+                finally:
+                    await pubsub.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(1)  # Redis hiccup — resubscribe
+
+    async def _rebuild_index(self) -> None:
+        """Load every persisted vector so this replica can answer similar prompts."""
+        batch = []
+        async for vector_key in redis_client.client.scan_iter(match=f"{VECTOR_PREFIX}*", count=1000):
+            if isinstance(vector_key, bytes):
+                vector_key = vector_key.decode()
+            batch.append("ai_cache:" + vector_key[len(VECTOR_PREFIX):])
+            if len(batch) >= 500:
+                await self._load_vectors(batch)
+                batch = []
+        if batch:
+            await self._load_vectors(batch)
+
+    async def _sync_bloom_loop(self) -> None:
+        """Rebuild the filter from Redis when (re)subscribed and every sync interval."""
+        while True:
+            try:
+                await asyncio.wait_for(self._bloom_resync.wait(), CACHE_BLOOM_SYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._bloom_resync.clear()
+            fresh = self._bloom.begin_rebuild()
+            try:
+                async for key in redis_client.client.scan_iter(match="ai_cache:*", count=1000):
+                    fresh.add(key.decode() if isinstance(key, bytes) else key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._bloom.abort_rebuild()  # Keep the current filter; retry next interval
+                continue
+            self._bloom.finish_rebuild(fresh)
+
+    async def _load_vectors(self, keys) -> None:
+        import numpy as np
+
+        pipe = redis_client.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(self._vector_key(key))
+            pipe.pttl(self._vector_key(key))
+        results = await pipe.execute()
+        for key, raw, pttl in zip(keys, results[::2], results[1::2]):
+            if raw and pttl and pttl > 0:
+                self._add_vector(key, np.frombuffer(raw, dtype=np.float32), pttl / 1000)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
 
-# ---
-# 💡 Upgrade path: Vector Similarity Cache
-# Instead of exact SHA-256 matching, embed the prompt and search for
-# semantically similar cached responses using Pinecone or pgvector.
-# This can cache ~80% of user queries even when phrased differently.
-# ---
+    def stats(self) -> dict:
+        lookups = self._l1_hits + self._l2_hits + self._similar_hits + self._misses
+        reached_redis = lookups - self._l1_hits
+        stats = {
+            "lookups": lookups,
+            "l1": {
+                **self._l1.stats(),
+                "hits": self._l1_hits,
+                "hit_ratio": round(self._l1_hits / lookups, 4) if lookups else 0.0,
+            },
+            "l2": {
+                "hits": self._l2_hits,
+                # Of the lookups that reached Redis
+                "hit_ratio": round(self._l2_hits / reached_redis, 4) if reached_redis else 0.0,
+            },
+            "stale_hits": self._stale_hits,
+            "misses": self._misses,
+            "compression": self._codec.stats(),
+            "admission": self._admission.stats(),
+            "redis_batching": self._redis.stats(),
+        }
+        if self._bloom is not None:
+            stats["bloom"] = {
+                **self._bloom.stats(),
+                "skipped_lookups": self._bloom_skips,
+                "false_positives": self._bloom_false_positives,
+            }
+        if self._semantic:
+            stats["semantic"] = {
+                "hits": self._similar_hits,
+                "partitions": len(self._indexes),
+                "vectors": sum(len(i) for i in self._indexes.values()),
+                "hit_ratio": round(self._similar_hits / lookups, 4) if lookups else 0.0,
+            }
+        return stats
@@ -0,0 +1,156 @@
+"""
+Circuit Breaker
+Tracks upstream health per (backend, model). After repeated failures the
+circuit opens and calls fail immediately instead of waiting on timeouts;
+after a cool-down a few probe calls are let through to detect recovery.
+"""
+
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import openai
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # consecutive
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))      # seconds open
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "2"))
+NOT_PROBE = 0  # Ticket for calls admitted while closed; half-open rounds count from 1
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, detail: str, retry_after: float = BREAKER_RESET_TIMEOUT):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Only failures that say something about backend health trip the circuit."""
+    if isinstance(exc, openai.APIConnectionError):  # Includes timeouts
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        half_open_probes: int = BREAKER_HALF_OPEN_PROBES,
+    ):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._round = 0  # Half-open rounds so far — a probe's ticket
+
+    def is_blocked(self) -> bool:
+        """True while open and still cooling down (no state change)."""
+        return self.state == self.OPEN and time.monotonic() - self._opened_at < self._reset_timeout
+
+    def can_allow(self) -> bool:
+        """Whether allow() would admit a call right now (no state change)."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return not self.is_blocked() and self._half_open_probes > 0
+        return self._probes_in_flight < self._half_open_probes
+
+    def retry_after(self) -> float:
+        return max(0.0, self._reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> Optional[int]:
+        """
+        Admit a call, or return None. The ticket goes back to on_success /
+        on_failure / on_ignored: the half-open round for a probe, NOT_PROBE
+        otherwise. Only the current round's probes move the probe counters or
+        close the circuit; calls admitted before it opened change nothing.
+        """
+        if self.state == self.OPEN:
+            if self.is_blocked():
+                return None
+            self.state = self.HALF_OPEN
+            self._round += 1
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        if self.state == self.HALF_OPEN:
+            if self._probes_in_flight >= self._half_open_probes:
+                return None
+            self._probes_in_flight += 1
+            return self._round
+        return NOT_PROBE
+
+    def on_success(self, ticket: int = NOT_PROBE) -> None:
+        if self._is_probe(ticket):
+            self._probes_in_flight -= 1
+            self._probe_successes += 1
+            if self._probe_successes >= self._half_open_probes:
+                self.state = self.CLOSED
+                self._failures = 0
+        elif self.state == self.CLOSED:
+            self._failures = 0
+
+    def on_failure(self, ticket: int = NOT_PROBE) -> None:
+        if self._is_probe(ticket):
+            self._trip()
+            return
+        if self.state != self.CLOSED:
+            return  # Admitted before the circuit opened — the outage is already known
+        self._failures += 1
+        if self._failures >= self._failure_threshold:
+            self._trip()
+
+    def on_ignored(self, ticket: int = NOT_PROBE) -> None:
+        """Call finished without telling us anything (cancelled, client error)."""
+        if self._is_probe(ticket):
+            self._probes_in_flight -= 1
+
+    def _is_probe(self, ticket: int) -> bool:
+        return ticket != NOT_PROBE and self.state == self.HALF_OPEN and ticket == self._round
+
+    def _trip(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._failures = 0
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_after_s": round(self.retry_after(), 1) if self.state == self.OPEN else 0,
+        }
+
+
+class BreakerRegistry:
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, backend_url: str, model: str) -> CircuitBreaker:
+        key = (backend_url, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker()
+        return breaker
+
+    def blocked(self, model: str) -> Set[str]:
+        """
+        Backend URLs whose circuit for this model can't admit a call: open and
+        cooling down, or half-open with every probe slot taken.
+        """
+        return {url for (url, m), b in self._breakers.items() if m == model and not b.can_allow()}
+
+    def forget(self, backend_url: str) -> None:
+        for key in [k for k in self._breakers if k[0] == backend_url]:
+            del self._breakers[key]
+
+    def stats(self) -> dict:
+        return {f"{url} {model}": b.stats() for (url, model), b in self._breakers.items()}
@@ -0,0 +1,122 @@
+"""
+Cache Value Codec
+Transparent compression for cache payloads. Values under a size threshold are
+stored as plain JSON text, exactly as before; larger ones are a binary header
+(NUL "AC", codec byte, dictionary id for zstd+dict) followed by the zstd/zlib
+body. JSON text never starts with NUL, so old and new entries coexist.
+"""
+
+import os
+import time
+import zlib
+from typing import Union
+
+try:
+    import zstandard
+except ImportError:  # Optional — fall back to zlib
+    zstandard = None
+
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd")  # "zstd" | "zlib" | "none"
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "512"))
+# A trained dictionary makes short values worth compressing too
+CACHE_ZSTD_DICT = os.getenv("CACHE_ZSTD_DICT", "")  # path to a dictionary file
+CACHE_COMPRESS_DICT_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_DICT_MIN_BYTES", "64"))
+ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+ZLIB_LEVEL = int(os.getenv("CACHE_ZLIB_LEVEL", "6"))
+
+MAGIC = b"\x00AC"
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_ZSTD_DICT = 3
+
+
+class ValueCodec:
+    def __init__(self, algorithm: str = CACHE_COMPRESSION, dict_path: str = CACHE_ZSTD_DICT):
+        if algorithm == "zstd" and zstandard is None:
+            algorithm = "zlib"
+        self._algorithm = algorithm
+
+        self._dict = None
+        self._dict_id = 0
+        if zstandard is not None:
+            # Kept even under zlib, to read values written by zstd replicas
+            self._decompressor = zstandard.ZstdDecompressor()
+        if algorithm == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            if dict_path:
+                with open(dict_path, "rb") as f:
+                    self._dict = zstandard.ZstdCompressionDict(f.read())
+                self._dict_id = self._dict.dict_id()
+                self._dict_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=self._dict)
+                self._dict_decompressor = zstandard.ZstdDecompressor(dict_data=self._dict)
+
+        self.raw_values = 0
+        self.compressed_values = 0
+        self.bytes_in = 0    # Before compression (compressed values only)
+        self.bytes_out = 0   # After compression, incl. header
+        self.compress_seconds = 0.0
+        self.decompress_seconds = 0.0
+
+    def encode(self, text: str) -> Union[str, bytes]:
+        data = text.encode()
+        threshold = CACHE_COMPRESS_DICT_MIN_BYTES if self._dict else CACHE_COMPRESS_MIN_BYTES
+        if self._algorithm == "none" or len(data) < threshold:
+            self.raw_values += 1
+            return text
+
+        start = time.perf_counter()
+        if self._algorithm == "zstd" and self._dict:
+            header = MAGIC + bytes([CODEC_ZSTD_DICT]) + self._dict_id.to_bytes(4, "big")
+            body = self._dict_compressor.compress(data)
+        elif self._algorithm == "zstd":
+            header = MAGIC + bytes([CODEC_ZSTD])
+            body = self._compressor.compress(data)
+        else:
+            header = MAGIC + bytes([CODEC_ZLIB])
+            body = zlib.compress(data, ZLIB_LEVEL)
+        self.compress_seconds += time.perf_counter() - start
+
+        if len(header) + len(body) >= len(data):
+            self.raw_values += 1
+            return text  # Incompressible — not worth the header
+        self.compressed_values += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(header) + len(body)
+        return header + body
+
+    def decode(self, value: Union[str, bytes]) -> Union[str, bytes]:
+        """Stored value -> JSON text (str or bytes). Raises if it can't be read here."""
+        if isinstance(value, str) or not value.startswith(MAGIC):
+            return value
+        codec = value[len(MAGIC)]
+        body = value[len(MAGIC) + 1:]
+        start = time.perf_counter()
+        try:
+            if codec == CODEC_ZLIB:
+                return zlib.decompress(body)
+            if codec == CODEC_ZSTD and zstandard is not None:
+                return self._decompressor.decompress(body)
+            if codec == CODEC_ZSTD_DICT and self._dict and int.from_bytes(body[:4], "big") == self._dict_id:
+                return self._dict_decompressor.decompress(body[4:])
+            raise ValueError(f"Unreadable cache value (codec {codec})")
+        finally:
+            self.decompress_seconds += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {
+            "algorithm": self._algorithm,
+            "dict_id": self._dict_id or None,
+            "raw_values": self.raw_values,
+            "compressed_values": self.compressed_values,
+            "compression_ratio": round(self.bytes_in / self.bytes_out, 3) if self.bytes_out else None,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "compress_ms": round(self.compress_seconds * 1000, 2),
+            "decompress_ms": round(self.decompress_seconds * 1000, 2),
+        }
+
+
+def train_dictionary(samples: list, size: int = 16 * 1024) -> bytes:
+    """Train a shared zstd dictionary from sample responses (write it to CACHE_ZSTD_DICT)."""
+    if zstandard is None:
+        raise RuntimeError("Dictionary training needs the `zstandard` package")
+    return zstandard.train_dictionary(size, [s.encode() for s in samples]).as_bytes()
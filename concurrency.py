@@ -0,0 +1,161 @@
+"""
+Adaptive Concurrency Limiter
+Caps concurrent upstream calls at a limit that follows observed latency
+(gradient-style AIMD): the limit grows by ~1 per round of healthy calls and
+shrinks multiplicatively when short-term latency rises well above the
+long-term baseline, or when calls time out. Each kind of call (completion,
+stream time-to-first-byte) has its own baseline, since their latencies aren't
+comparable. Excess requests wait briefly in
+a bounded priority queue, then get ConcurrencyLimitExceeded (→ fast 503).
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from app.services.priority import DEFAULT_PRIORITY, PriorityQueue, starvation_wait
+
+CONCURRENCY_INITIAL = int(os.getenv("CONCURRENCY_INITIAL", "32"))
+CONCURRENCY_MIN = int(os.getenv("CONCURRENCY_MIN", "4"))
+CONCURRENCY_MAX = int(os.getenv("CONCURRENCY_MAX", "512"))
+CONCURRENCY_TOLERANCE = float(os.getenv("CONCURRENCY_TOLERANCE", "2.0"))  # short/long latency ratio
+CONCURRENCY_BACKOFF = float(os.getenv("CONCURRENCY_BACKOFF", "0.9"))
+CONCURRENCY_QUEUE_SIZE = int(os.getenv("CONCURRENCY_QUEUE_SIZE", "256"))
+CONCURRENCY_QUEUE_TIMEOUT_MS = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT_MS", "500"))
+
+SHORT_ALPHA = 0.3    # Reacts within a handful of calls
+LONG_ALPHA = 0.02    # Baseline drifts over hundreds of calls
+
+
+class ConcurrencyLimitExceeded(Exception):
+    pass
+
+
+class Permit:
+    """
+    Handed to the caller; set `latency` to override the measured sample, and
+    `kind` when that sample isn't a full completion (e.g. "stream" for TTFB).
+    """
+
+    __slots__ = ("latency", "dropped", "kind")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.dropped = False  # Mark True when the call timed out / overloaded upstream
+        self.kind = "completion"
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: int = CONCURRENCY_INITIAL,
+        min_limit: int = CONCURRENCY_MIN,
+        max_limit: int = CONCURRENCY_MAX,
+        queue_size: int = CONCURRENCY_QUEUE_SIZE,
+        queue_timeout: float = CONCURRENCY_QUEUE_TIMEOUT_MS / 1000,
+    ):
+        self.limit = float(initial)
+        self._min = min_limit
+        self._max = max_limit
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = PriorityQueue(max_wait=starvation_wait(queue_timeout))
+        # Per kind of call — short/long latency EWMAs, seconds
+        self._short_latency: Dict[str, float] = {}
+        self._long_latency: Dict[str, float] = {}
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def acquire(
+        self,
+        timeout: Optional[float] = None,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> AsyncIterator[Permit]:
+        """
+        Hold one concurrency slot for the block. Waits at most the queue timeout
+        (or `timeout`, if shorter) for a slot before raising; queued callers are
+        served by priority class.
+        """
+        await self._enter(timeout, priority)
+        permit = Permit()
+        start = time.monotonic()
+        try:
+            yield permit
+        except BaseException:
+            self._release(None, permit.dropped, permit.kind)
+            raise
+        self._release(permit.latency or time.monotonic() - start, permit.dropped, permit.kind)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "queue_by_priority": self._waiters.depth_by_class(),
+            "starvation_promotions": self._waiters.promoted,
+            "rejected": self.rejected,
+            "latency_ms": {
+                kind: {
+                    "short": round(self._short_latency[kind] * 1000, 2),
+                    "long": round(self._long_latency[kind] * 1000, 2),
+                }
+                for kind in self._long_latency
+            },
+        }
+
+    async def _enter(self, timeout: Optional[float], priority: int) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self._queue_size:
+            self.rejected += 1
+            raise ConcurrencyLimitExceeded("Upstream concurrency limit reached (queue full)")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.push(priority, future)
+        wait = self._queue_timeout if timeout is None else min(timeout, self._queue_timeout)
+        try:
+            await asyncio.wait_for(future, wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self._release_slot()  # Granted a slot just as we gave up — pass it on
+            else:
+                self._waiters.remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise ConcurrencyLimitExceeded("Upstream concurrency limit reached (queue timeout)")
+            raise
+
+    def _release(self, latency: Optional[float], dropped: bool, kind: str) -> None:
+        if dropped:
+            self.limit = max(self._min, self.limit * CONCURRENCY_BACKOFF)
+        elif latency is not None:
+            self._observe(latency, kind)
+        self._release_slot()
+
+    def _observe(self, latency: float, kind: str) -> None:
+        if kind not in self._long_latency:
+            self._short_latency[kind] = self._long_latency[kind] = latency
+            return
+        short = self._short_latency[kind] + SHORT_ALPHA * (latency - self._short_latency[kind])
+        long = self._long_latency[kind] + LONG_ALPHA * (latency - self._long_latency[kind])
+        self._short_latency[kind] = short
+        self._long_latency[kind] = long
+
+        if short > long * CONCURRENCY_TOLERANCE:
+            self.limit = max(self._min, self.limit * CONCURRENCY_BACKOFF)
+        elif self.in_flight >= self.limit / 2:
+            # Only grow while we're actually using the limit we have
+            self.limit = min(self._max, self.limit + 1 / self.limit)
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.pop()
+            if future.done():
+                continue  # Waiter already gave up
+            self.in_flight += 1
+            future.set_result(None)
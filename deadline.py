@@ -0,0 +1,83 @@
+"""
+Request Deadlines
+A per-request time budget, taken from the client's X-Request-Timeout header
+(seconds) or a per-model default. Every stage — cache lookup, queueing, the
+upstream call — only gets whatever budget is left.
+"""
+
+import asyncio
+import inspect
+import os
+import time
+from typing import Any, Awaitable, Dict, Mapping
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("DEFAULT_REQUEST_TIMEOUT", "60"))  # seconds
+MAX_REQUEST_TIMEOUT = float(os.getenv("MAX_REQUEST_TIMEOUT", "300"))
+
+
+def _parse_timeouts(spec: str) -> Dict[str, float]:
+    """Parse "gpt-4o=60,gpt-4o-mini=20" into {model: seconds}."""
+    timeouts = {}
+    for item in spec.split(","):
+        model, _, seconds = item.strip().partition("=")
+        if model and seconds:
+            timeouts[model] = float(seconds)
+    return timeouts
+
+
+MODEL_TIMEOUTS = _parse_timeouts(os.getenv("MODEL_TIMEOUTS", ""))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, timeout: float, explicit: bool = False):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        # True when the client asked for this budget. Defaults only bound the
+        # wait for a first token — they never cut off a stream that's flowing.
+        self.explicit = explicit
+
+    @classmethod
+    def from_request(cls, headers: Mapping[str, str], model: str) -> "Deadline":
+        timeout = MODEL_TIMEOUTS.get(model, DEFAULT_REQUEST_TIMEOUT)
+        explicit = False
+        raw = headers.get(TIMEOUT_HEADER)
+        if raw:
+            try:
+                timeout = float(raw)
+                explicit = True
+            except ValueError:
+                pass  # Ignore malformed header — keep the default
+        return cls(max(0.0, min(timeout, MAX_REQUEST_TIMEOUT)), explicit)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, expected: float = 0.0, stage: str = "request") -> None:
+        """Refuse up front if the budget left can't cover the expected latency."""
+        remaining = self.remaining()
+        if remaining <= 0 or remaining < expected:
+            raise DeadlineExceeded(
+                f"{stage}: {remaining * 1000:.0f}ms left, expected {expected * 1000:.0f}ms"
+            )
+
+    async def run(self, aw: Awaitable[Any], stage: str = "request") -> Any:
+        """Await with whatever budget is left."""
+        try:
+            self.check(stage=stage)
+        except DeadlineExceeded:
+            if inspect.iscoroutine(aw):
+                aw.close()  # Never started — avoid "never awaited" warnings
+            raise
+        try:
+            return await asyncio.wait_for(aw, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{stage}: deadline of {self.timeout:g}s exceeded")
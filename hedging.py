@@ -0,0 +1,53 @@
+"""
+Hedged Requests
+If the chosen backend hasn't answered within its rolling p95, a duplicate
+request is sent to another backend and the first answer wins. A token-bucket
+budget caps the extra load so a degraded cluster isn't doubled.
+"""
+
+import os
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))  # max extra load, fraction of requests
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", "10"))      # hedges that can be saved up
+
+
+class HedgeBudget:
+    """Every primary request earns `ratio` tokens; every hedge spends one."""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET, burst: float = HEDGE_BURST):
+        self._ratio = ratio
+        self._burst = burst
+        self._tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.denied = 0
+        self.wins = 0  # Hedges that answered before the primary
+
+    def on_request(self) -> None:
+        self.requests += 1
+        self._tokens = min(self._burst, self._tokens + self._ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            self.hedges += 1
+            return True
+        self.denied += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "denied": self.denied,
+            "wins": self.wins,
+            "tokens": round(self._tokens, 2),
+        }
+
+
+def hedge_delay(p_latency: float) -> float:
+    """Seconds to wait on the primary before hedging."""
+    return max(p_latency, HEDGE_MIN_DELAY_MS / 1000)
@@ -0,0 +1,62 @@
+"""
+HTTP Transport Service
+One explicitly tuned httpx.AsyncClient shared by every upstream provider
+client, so pool size, keepalive and timeouts are ours rather than SDK defaults.
+"""
+
+import importlib.util
+import os
+
+import httpx
+
+from app.services.deadline import MAX_REQUEST_TIMEOUT
+
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50"))
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))  # seconds
+HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1"   # Needs the `h2` package (httpx[http2])
+
+HTTP_TIMEOUT = httpx.Timeout(
+    connect=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5")),
+    # A non-streaming call reads nothing until generation ends — don't cut it
+    # off before the longest deadline a client may ask for
+    read=float(os.getenv("UPSTREAM_READ_TIMEOUT", str(MAX_REQUEST_TIMEOUT))),
+    write=float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "10")),
+    pool=float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5")),
+)
+
+
+def build_http_client() -> httpx.AsyncClient:
+    # HTTP/2 is negotiated via ALPN, so plain-http backends keep using HTTP/1.1
+    http2 = HTTP2 and importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def pool_stats(client: httpx.AsyncClient) -> dict:
+    """
+    Idle vs active connections in the client's pool.
+    Reads httpcore internals, so degrades to zeros if their shape changes.
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for c in connections if c.is_idle())
+    http2 = sum(1 for c in connections if "HTTP/2" in repr(c))
+    # _requests also holds requests already assigned a connection; only count waiters
+    queued = sum(1 for r in getattr(pool, "_requests", []) if getattr(r, "connection", None) is None)
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "http2": http2,
+        "queued_requests": queued,
+        "max_connections": MAX_CONNECTIONS,
+        "max_keepalive": MAX_KEEPALIVE,
+    }
@@ -3,63 +3,147 @@ Inference Router
 Handles AI completion requests — both standard and streaming.
 """
 
+import asyncio
+import math
+import os
+import re
 import time
 import uuid
-from typing import AsyncGenerator
+from typing import AsyncGenerator, List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 from app.models.schemas import InferenceRequest, InferenceResponse
-from app.services.cache import SemanticCache
-from app.services.inference_engine import InferenceEngine
+from app.services.cache import CacheEntry, SemanticCache
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.concurrency import ConcurrencyLimitExceeded
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.inference_engine import CHAT_PATH, Completion, InferenceEngine
+from app.services.leases import UserConcurrencyExceeded, UserConcurrencyLimiter
+from app.services.priority import BACKGROUND_PRIORITY, PRIORITY_HEADER, priority_for
+from app.services.refresh import BackgroundRefresher
+from app.services.singleflight import SingleFlight
+from app.services.token_quota import QuotaExceeded, RequestTooLarge, TokenQuota, estimate_tokens
 from app.middleware.auth import get_current_user
 
+# Replaying cached completions over SSE: 0 chars = send the whole text at once
+CACHE_REPLAY_CHUNK_CHARS = int(os.getenv("CACHE_REPLAY_CHUNK_CHARS", "0"))
+CACHE_REPLAY_DELAY_MS = float(os.getenv("CACHE_REPLAY_DELAY_MS", "0"))  # pause between chunks
+
+_SSE_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Disable Nginx buffering
+}
+
 router = APIRouter()
 cache = SemanticCache()
 engine = InferenceEngine()
+flights = SingleFlight()
+refresher = BackgroundRefresher()
+quota = TokenQuota()
+leases = UserConcurrencyLimiter()
 
 
 @router.post("/complete", response_model=InferenceResponse)
 async def complete(
     request: InferenceRequest,
+    http_request: Request,
     user: dict = Depends(get_current_user),
 ):
     """
     Standard (non-streaming) AI completion endpoint.
     Checks semantic cache first to avoid redundant inference.
+    Honours the client's X-Request-Timeout (seconds) end to end.
+    Cache misses take one of the caller's concurrency slots and are charged
+    against their token quota.
     """
     request_id = str(uuid.uuid4())
     start = time.time()
+    deadline = Deadline.from_request(http_request.headers, request.model)
+    priority = priority_for(user, http_request.headers.get(PRIORITY_HEADER))
+    path = engine.completion_path  # Batched answers are cached apart from chat ones
 
-    # 1. Check semantic cache
-    cached = await cache.get(request.prompt)
-    if cached:
+    # 1. Check semantic cache (stale entries are served, then refreshed)
+    cached = await cache.lookup(
+        request.prompt,
+        request.model,
+        request.max_tokens,
+        request.temperature,
+        deadline=deadline,
+        path=path,
+    )
+    if cached and cached.value:
+        _refresh_if_stale(cached, request, path)
         return InferenceResponse(
             id=request_id,
-            text=cached,
+            text=cached.value,
             cached=True,
             latency_ms=round((time.time() - start) * 1000, 2),
             model=request.model,
         )
 
-    # 2. Run inference
+    # 2. Take a per-user slot and reserve estimated tokens — released/settled below
+    identifier = _caller_id(http_request, user)
+    lease = await _acquire_lease(identifier, "request", deadline)
     try:
-        result = await engine.generate(
-            prompt=request.prompt,
-            model=request.model,
-            max_tokens=request.max_tokens,
-            temperature=request.temperature,
+        reservation = await _reserve_tokens(request, identifier)
+    except HTTPException:
+        await leases.release(lease)
+        raise
+
+    # 3. Run inference + store in cache — identical in-flight prompts share one call.
+    # The shared call has no cap of its own; each caller only waits for its own
+    # remaining budget.
+    used_tokens = 0  # Refunded unless this caller's own call reached upstream
+    try:
+        engine.check_deadline(request.model, deadline)
+        key = cache._key(request.prompt, request.model, request.max_tokens, request.temperature, path)
+        if not flights.pending(key):
+            # We lead. If we stop waiting (timeout, disconnect) the call may
+            # still be generating, so the estimate stands unless we learn more
+            used_tokens = estimate_tokens(request.prompt) + request.max_tokens
+        completion, shared = await flights.do(
+            key,
+            lambda: _generate_and_cache(request, priority, path),
+            timeout=deadline.remaining(),
         )
+        if shared:
+            used_tokens = 0  # Followers rode on the leader's call — nothing to charge
+        else:
+            used_tokens = completion.usage_tokens
+            if used_tokens is None:  # Provider didn't report usage (e.g. batched)
+                used_tokens = estimate_tokens(request.prompt) + estimate_tokens(completion.text)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Deadline exceeded: {str(e)}")
+    except asyncio.TimeoutError:
+        if not deadline.expired:  # Some other timeout — not this caller's budget
+            raise HTTPException(status_code=503, detail="Inference failed: upstream timed out")
+        raise HTTPException(status_code=504, detail=f"Deadline exceeded: {deadline.timeout:g}s")
+    except CircuitOpenError as e:
+        used_tokens = 0  # Never reached upstream
+        raise HTTPException(
+            status_code=503,
+            detail=f"Inference unavailable: {str(e)}",
+            headers={"Retry-After": str(int(e.retry_after) or 1)},
+        )
+    except ConcurrencyLimitExceeded as e:
+        used_tokens = 0  # Never reached upstream
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
+        # Upstream failed — it read our prompt but generated nothing we can use
+        used_tokens = min(used_tokens, estimate_tokens(request.prompt))
         raise HTTPException(status_code=503, detail=f"Inference failed: {str(e)}")
-
-    # 3. Store in cache
-    await cache.set(request.prompt, result)
+    finally:
+        await quota.settle(reservation, used_tokens)
+        await leases.release(lease)
 
     return InferenceResponse(
         id=request_id,
-        text=result,
+        text=completion.text,
         cached=False,
         latency_ms=round((time.time() - start) * 1000, 2),
         model=request.model,
@@ -69,6 +153,7 @@ async def complete(
 @router.post("/stream")
 async def stream(
     request: InferenceRequest,
+    http_request: Request,
     user: dict = Depends(get_current_user),
 ):
     """
@@ -78,23 +163,213 @@ async def stream(
     Client usage:
         const es = new EventSource('/v1/inference/stream');
         es.onmessage = (e) => console.log(e.data);
+
+    Cache hits are replayed as SSE; completed streams are written to the cache.
+    Live streams hold one of the caller's concurrent-stream slots.
     """
+    start = time.time()
+    deadline = Deadline.from_request(http_request.headers, request.model)
+
+    cached = await cache.lookup(
+        request.prompt,
+        request.model,
+        request.max_tokens,
+        request.temperature,
+        deadline=deadline,
+    )
+    if cached and cached.value:
+        _refresh_if_stale(cached, request, CHAT_PATH)
+        return StreamingResponse(
+            _replay(cached.value),
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, "X-Cache": "HIT"},
+        )
+
+    # Fail fast before the 200 + SSE headers go out
+    if not engine.available(request.model):
+        raise HTTPException(status_code=503, detail="Inference unavailable: upstream circuit open")
+
+    identifier = _caller_id(http_request, user)
+    lease = await _acquire_lease(identifier, "stream", deadline)
+    try:
+        reservation = await _reserve_tokens(request, identifier)
+    except HTTPException:
+        await leases.release(lease)
+        raise
+
+    async def abandon() -> None:
+        await quota.refund(reservation)
+        await leases.release(lease)
+
+    usage: List[int] = []  # Provider-reported total, once the stream is read to the end
+    tokens = engine.stream(
+        prompt=request.prompt,
+        model=request.model,
+        max_tokens=request.max_tokens,
+        temperature=request.temperature,
+        deadline=deadline,
+        priority=priority_for(user, http_request.headers.get(PRIORITY_HEADER)),
+        on_usage=usage.append,
+    )
+
+    # Wait for the first token before committing to a 200, so admission
+    # failures (deadline, concurrency limit) still get a proper status code
+    try:
+        first = await tokens.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except DeadlineExceeded as e:
+        await abandon()
+        raise HTTPException(status_code=504, detail=f"Deadline exceeded: {str(e)}")
+    except ConcurrencyLimitExceeded as e:
+        await abandon()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        await abandon()
+        raise HTTPException(status_code=503, detail=f"Inference failed: {str(e)}")
+
+    parts = [] if first is None else [first]
+
+    async def finish() -> None:
+        """
+        Release everything the stream holds. Runs when the body ends and again
+        as the response's background task, for bodies that never ran or were
+        cancelled mid-cleanup; every step is idempotent.
+        """
+        try:
+            # Closes the upstream response and frees its limiter slot, backend
+            # in-flight count and breaker probe
+            await tokens.aclose()
+        finally:
+            await leases.release(lease)
+            # Without reported usage (stream cut short), one chunk ≈ one token
+            used = usage[-1] if usage else estimate_tokens(request.prompt) + len(parts)
+            await quota.settle(reservation, used)
 
     async def token_generator() -> AsyncGenerator[str, None]:
-        async for token in engine.stream(
-            prompt=request.prompt,
-            model=request.model,
-            max_tokens=request.max_tokens,
-            temperature=request.temperature,
-        ):
-            yield f"data: {token}\n\n"
-        yield "data: [DONE]\n\n"
+        completed = False
+        try:
+            if first is not None:
+                yield _sse_event(first)
+            async for token in tokens:
+                if await http_request.is_disconnected():
+                    break  # Client went away — stop paying for GPU tokens
+                parts.append(token)
+                yield _sse_event(token)
+            else:
+                completed = True
+                yield "data: [DONE]\n\n"
+        except DeadlineExceeded:
+            yield "event: error\ndata: deadline exceeded\n\n"
+        finally:
+            await finish()  # Free everything the moment the stream ends
+
+        # Only a stream that reached [DONE] is a complete answer worth caching
+        if completed and parts:
+            await cache.set(
+                request.prompt,
+                "".join(parts),
+                request.model,
+                request.max_tokens,
+                request.temperature,
+                cost_ms=(time.time() - start) * 1000,
+            )
 
     return StreamingResponse(
         token_generator(),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",  # Disable Nginx buffering
-        },
+        headers={**SSE_HEADERS, "X-Cache": "MISS"},
+        # Backstop if the body is never iterated to the end
+        background=BackgroundTask(finish),
+    )
+
+
+async def _generate_and_cache(request: InferenceRequest, priority: int, path: str) -> Completion:
+    start = time.time()
+    completion = await engine.complete(
+        prompt=request.prompt,
+        model=request.model,
+        max_tokens=request.max_tokens,
+        temperature=request.temperature,
+        priority=priority,
+        path=path,
+    )
+    await cache.set(
+        request.prompt,
+        completion.text,
+        request.model,
+        request.max_tokens,
+        request.temperature,
+        cost_ms=(time.time() - start) * 1000,
+        path=path,
     )
+    return completion
+
+
+def _caller_id(http_request: Request, user: dict) -> str:
+    return user.get("sub") if user else http_request.client.host
+
+
+async def _acquire_lease(identifier: str, kind: str, deadline: Deadline):
+    """Take a per-user concurrency slot (queueing briefly if configured), or 429."""
+    try:
+        return await leases.acquire(identifier, kind, timeout=deadline.remaining())
+    except UserConcurrencyExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+
+async def _reserve_tokens(request: InferenceRequest, identifier: str):
+    """Reserve the request's estimated tokens, or reject it (429, or 413 if it can never fit)."""
+    try:
+        return await quota.reserve(identifier, request.prompt, request.max_tokens)
+    except RequestTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QuotaExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+
+def _refresh_if_stale(entry: CacheEntry, request: InferenceRequest, path: str) -> None:
+    """
+    Stale-while-revalidate: regenerate past-soft-TTL entries in the background,
+    on the same generation path that produced them.
+    """
+    if not entry.stale:
+        return
+    key = cache._key(request.prompt, request.model, request.max_tokens, request.temperature, path)
+
+    async def refresh() -> None:
+        if not await cache.claim_refresh(key):
+            # Another replica is refreshing — keep serving without re-claiming,
+            # then pick its result up from Redis once our copy lapses
+            await cache.reload(key, hold_stale=True)
+            return
+        if await cache.reload(key):
+            return  # Refreshed by whoever held the lock before us
+        await flights.do(key, lambda: _generate_and_cache(request, BACKGROUND_PRIORITY, path))
+
+    refresher.schedule(key, refresh)
+
+
+async def _replay(text: str) -> AsyncGenerator[str, None]:
+    """Re-emit a cached completion as SSE, optionally chunked and paced."""
+    if CACHE_REPLAY_CHUNK_CHARS <= 0:
+        yield _sse_event(text)
+    else:
+        for i in range(0, len(text), CACHE_REPLAY_CHUNK_CHARS):
+            yield _sse_event(text[i:i + CACHE_REPLAY_CHUNK_CHARS])
+            if CACHE_REPLAY_DELAY_MS > 0:
+                await asyncio.sleep(CACHE_REPLAY_DELAY_MS / 1000)
+    yield "data: [DONE]\n\n"
+
+
+def _sse_event(text: str) -> str:
+    """
+    One SSE message carrying text. Each line goes in its own `data:` field
+    (clients rejoin them with "\n"), so newlines in the text can't end the
+    event early or be dropped.
+    """
+    return "".join(f"data: {line}\n" for line in _SSE_LINE_BREAK.split(text)) + "\n"
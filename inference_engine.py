@@ -4,47 +4,159 @@ Abstracts your AI model calls. Swap out the provider easily.
 Currently supports: OpenAI, vLLM (self-hosted), HuggingFace.
 """
 
+import asyncio
 import os
-from typing import AsyncGenerator
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Callable, Iterable, List, NamedTuple, Optional
 
-import httpx
 from openai import AsyncOpenAI
 
+from app.services.batcher import BATCH_WINDOW_MS, MicroBatcher
+from app.services.circuit_breaker import BreakerRegistry, CircuitOpenError, is_upstream_failure
+from app.services.concurrency import AdaptiveLimiter, Permit
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.hedging import HEDGE_ENABLED, HEDGE_PERCENTILE, HedgeBudget, hedge_delay
+from app.services.http_transport import HTTP_TIMEOUT, build_http_client, pool_stats
+from app.services.priority import DEFAULT_PRIORITY
+from app.services.upstream_pool import (
+    VLLM_BACKENDS,
+    Backend,
+    UpstreamPool,
+    parse_backends,
+)
+
 # --- Provider config ---
 PROVIDER = os.getenv("AI_PROVIDER", "openai")   # "openai" | "vllm" | "huggingface"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://localhost:8000/v1")
+# SDK-level retries multiply time-to-failure; the circuit breaker handles outages
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "1"))
+# Generation paths. Batched calls skip the chat template, so their answers
+# differ from chat ones and are cached apart (see SemanticCache._key)
+CHAT_PATH = "chat"
+BATCH_PATH = "completions"
+
+
+class Completion(NamedTuple):
+    text: str
+    usage_tokens: Optional[int] = None  # Provider-reported total; None when not reported
 
 
 class InferenceEngine:
     def __init__(self):
+        # One tuned connection pool shared by every provider client
+        self._http = build_http_client()
+
         if PROVIDER == "openai":
-            self._client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+            self._pool = UpstreamPool(
+                lambda url: AsyncOpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=url,
+                    http_client=self._http,
+                    timeout=HTTP_TIMEOUT,
+                    max_retries=UPSTREAM_MAX_RETRIES,
+                ),
+                owns_clients=False,
+            )
+            self._pool.add(OPENAI_BASE_URL)
         elif PROVIDER == "vllm":
             # vLLM exposes an OpenAI-compatible API — just point the base URL
-            self._client = AsyncOpenAI(
-                api_key="vllm",   # vLLM doesn't require a real key
-                base_url=VLLM_BASE_URL,
+            self._pool = UpstreamPool(
+                lambda url: AsyncOpenAI(
+                    api_key="vllm",   # vLLM doesn't require a real key
+                    base_url=url,
+                    http_client=self._http,
+                    timeout=HTTP_TIMEOUT,
+                    max_retries=UPSTREAM_MAX_RETRIES,
+                ),
+                owns_clients=False,
             )
+            for url, weight in parse_backends(VLLM_BACKENDS or VLLM_BASE_URL):
+                self._pool.add(url, weight)
         else:
             raise ValueError(f"Unknown AI_PROVIDER: {PROVIDER}")
 
+        # Optional micro-batching of non-streaming calls (vLLM only)
+        self._batcher = None
+        if PROVIDER == "vllm" and BATCH_WINDOW_MS > 0:
+            self._batcher = MicroBatcher(self._complete_batch)
+
+        # Opt-in hedging of slow non-streaming calls onto a second backend
+        self._hedge_budget = HedgeBudget()
+
+        # Per (backend, model) circuit breakers — fail fast while a backend is down
+        self._breakers = BreakerRegistry()
+
+        # Adaptive cap on concurrent upstream calls (generate + stream)
+        self._limiter = AdaptiveLimiter()
+
+        # Streams closed early by the caller (e.g. SSE client disconnected)
+        self._streams_cancelled = 0
+        self._tokens_saved_max = 0  # Upper bound — assumes each would have run to max_tokens
+
     async def generate(
         self,
         prompt: str,
         model: str,
         max_tokens: int = 1024,
         temperature: float = 0.7,
+        deadline: Optional[Deadline] = None,
+        priority: int = DEFAULT_PRIORITY,
     ) -> str:
-        """Non-streaming completion."""
-        response = await self._client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stream=False,
-        )
-        return response.choices[0].message.content
+        """Completion text only — see complete()."""
+        completion = await self.complete(prompt, model, max_tokens, temperature, deadline, priority)
+        return completion.text
+
+    @property
+    def completion_path(self) -> str:
+        """Path non-streaming calls take by default; streams always use CHAT_PATH."""
+        return BATCH_PATH if self._batcher else CHAT_PATH
+
+    async def complete(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int = 1024,
+        temperature: float = 0.7,
+        deadline: Optional[Deadline] = None,
+        priority: int = DEFAULT_PRIORITY,
+        path: Optional[str] = None,
+    ) -> Completion:
+        """
+        Non-streaming completion with the provider's token usage, bounded by
+        the request deadline if given. `priority` orders this call against
+        others waiting for upstream capacity; `path` forces CHAT_PATH or
+        BATCH_PATH (default: completion_path).
+        """
+        path = path or self.completion_path
+        coro = self._generate(prompt, model, max_tokens, temperature, priority, path)
+        if deadline is None:
+            return await coro
+        try:
+            self.check_deadline(model, deadline)
+        except DeadlineExceeded:
+            coro.close()
+            raise
+        return await deadline.run(coro, "upstream")
+
+    async def _generate(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        priority: int,
+        path: str,
+    ) -> Completion:
+        async with self._limited(priority=priority):
+            if self._batcher and path == BATCH_PATH:
+                # A batched response reports usage for the whole batch only
+                return Completion(await self._batcher.submit(prompt, model, max_tokens, temperature))
+            if HEDGE_ENABLED and len(self._pool) > 1:
+                return await self._generate_hedged(prompt, model, max_tokens, temperature)
+            return await self._chat(self._pick(model), prompt, model, max_tokens, temperature)
 
     async def stream(
         self,
@@ -52,16 +164,255 @@ class InferenceEngine:
         model: str,
         max_tokens: int = 1024,
         temperature: float = 0.7,
+        deadline: Optional[Deadline] = None,
+        priority: int = DEFAULT_PRIORITY,
+        on_usage: Optional[Callable[[int], None]] = None,
     ) -> AsyncGenerator[str, None]:
-        """Token-by-token streaming completion."""
-        response = await self._client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stream=True,
+        """
+        Token-by-token streaming completion. `on_usage` gets the provider's
+        total token count once the stream has been read to the end.
+        A deadline bounds the wait for the first token; only one the client set
+        explicitly also stops the stream with DeadlineExceeded once it runs out.
+        """
+        if deadline and deadline.explicit:
+            self.check_deadline(model, deadline)
+        elif deadline:
+            deadline.check(stage="upstream")  # Completion latency isn't the bound here
+
+        queue_timeout = deadline.remaining() if deadline else None
+        async with self._limited(queue_timeout, priority) as permit:
+            # The backend stays counted as busy until the stream is fully consumed
+            backend = self._pick(model)
+            async with self._guard(backend, model), \
+                    self._pool.acquire(backend=backend, record_latency=False):
+                start = time.monotonic()
+                create = backend.client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                response = await (deadline.run(create, "upstream") if deadline else create)
+                ttfb = time.monotonic() - start
+                backend.record_ttfb(ttfb)
+                # Stream length says nothing about load; TTFB gets its own baseline
+                permit.latency = ttfb
+                permit.kind = "stream"
+
+                emitted = 0
+                finished = False
+                try:
+                    async for chunk in response:
+                        if chunk.usage and on_usage:
+                            on_usage(chunk.usage.total_tokens)
+                        if not chunk.choices:
+                            continue  # The usage-only chunk that ends the stream
+                        token = chunk.choices[0].delta.content
+                        if token:
+                            emitted += 1  # One content delta ≈ one token
+                            yield token
+                        if deadline and deadline.explicit and deadline.expired:
+                            raise DeadlineExceeded("upstream: deadline exceeded mid-stream")
+                    finished = True
+                except (GeneratorExit, asyncio.CancelledError):
+                    # Caller closed us early (not an upstream error or deadline)
+                    self._streams_cancelled += 1
+                    self._tokens_saved_max += max(0, max_tokens - emitted)
+                    raise
+                finally:
+                    if not finished:
+                        # Drop the upstream connection so the provider stops generating
+                        await response.close()
+
+    # --- Backend management ---
+
+    def add_backend(self, url: str, weight: float = 1.0) -> None:
+        self._pool.add(url, weight)
+
+    async def remove_backend(self, url: str) -> None:
+        """Drain a backend — in-flight requests on it are not interrupted."""
+        await self._pool.remove(url)
+        self._breakers.forget(url)
+
+    def check_deadline(self, model: str, deadline: Deadline) -> None:
+        """Refuse now if what's left of the budget can't cover a typical call."""
+        try:
+            expected = self._pick(model).ewma_latency
+        except (CircuitOpenError, RuntimeError):
+            expected = 0.0  # Let the call itself surface the real error
+        deadline.check(expected, "upstream")
+
+    def available(self, model: str) -> bool:
+        """False when every backend's circuit for this model is open."""
+        try:
+            self._pick(model)
+        except (CircuitOpenError, RuntimeError):
+            return False
+        return True
+
+    def backend_stats(self) -> dict:
+        return self._pool.stats()
+
+    def transport_stats(self) -> dict:
+        return pool_stats(self._http)
+
+    def hedge_stats(self) -> dict:
+        return self._hedge_budget.stats()
+
+    def concurrency_stats(self) -> dict:
+        return self._limiter.stats()
+
+    def stream_stats(self) -> dict:
+        return {
+            "cancelled": self._streams_cancelled,
+            "tokens_saved_max": self._tokens_saved_max,  # Upper bound, not a measurement
+        }
+
+    def health(self) -> dict:
+        """Upstream status for /health."""
+        return {
+            "provider": PROVIDER,
+            "backends": self.backend_stats(),
+            "circuits": self._breakers.stats(),
+            "concurrency": self.concurrency_stats(),
+        }
+
+    async def aclose(self) -> None:
+        await self._pool.close()
+        await self._http.aclose()
+
+    def _pick(self, model: str, exclude: Iterable[str] = ()) -> Backend:
+        """Least-loaded backend whose circuit for this model can admit a call."""
+        blocked = self._breakers.blocked(model)
+        try:
+            return self._pool.pick(exclude=blocked | set(exclude))
+        except RuntimeError:
+            if not blocked:
+                raise
+            raise CircuitOpenError(f"All upstream circuits are open for {model}")
+
+    @asynccontextmanager
+    async def _limited(
+        self,
+        timeout: Optional[float] = None,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> AsyncIterator[Permit]:
+        """Hold a concurrency slot; upstream failures shrink the limit."""
+        async with self._limiter.acquire(timeout, priority) as permit:
+            try:
+                yield permit
+            except BaseException as e:
+                permit.dropped = is_upstream_failure(e)
+                raise
+
+    @asynccontextmanager
+    async def _guard(self, backend: Backend, model: str) -> AsyncIterator[None]:
+        """Fail fast on an open circuit and feed the call's outcome back into it."""
+        breaker = self._breakers.get(backend.url, model)
+        ticket = breaker.allow()
+        if ticket is None:
+            raise CircuitOpenError(
+                f"Circuit open for {backend.url} ({model})", breaker.retry_after()
+            )
+        try:
+            yield
+        except BaseException as e:
+            if is_upstream_failure(e):
+                breaker.on_failure(ticket)
+            else:
+                breaker.on_ignored(ticket)
+            raise
+        breaker.on_success(ticket)
+
+    async def _chat(
+        self,
+        backend: Backend,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+    ) -> Completion:
+        async with self._guard(backend, model), self._pool.acquire(backend=backend):
+            response = await backend.client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=False,
+            )
+        usage = response.usage
+        return Completion(response.choices[0].message.content, usage.total_tokens if usage else None)
+
+    async def _generate_hedged(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+    ) -> Completion:
+        """
+        Send to the best backend; if it hasn't answered by its rolling p95,
+        race a duplicate on another backend and keep whichever succeeds first.
+        The loser is cancelled, which closes its upstream connection.
+        """
+        self._hedge_budget.on_request()
+        primary = self._pick(model)
+        primary_task = asyncio.ensure_future(
+            self._chat(primary, prompt, model, max_tokens, temperature)
         )
-        async for chunk in response:
-            token = chunk.choices[0].delta.content
-            if token:
-                yield token
+        pending = {primary_task}
+        try:
+            done, _ = await asyncio.wait(
+                pending, timeout=hedge_delay(primary.percentile(HEDGE_PERCENTILE))
+            )
+            if not done:
+                try:
+                    secondary = self._pick(model, exclude={primary.url})
+                except (CircuitOpenError, RuntimeError):
+                    secondary = None  # Nowhere healthy to hedge to — keep the budget
+                if secondary and self._hedge_budget.try_spend():
+                    pending.add(asyncio.ensure_future(
+                        self._chat(secondary, prompt, model, max_tokens, temperature)
+                    ))
+
+            # A failure only counts once every copy has failed
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary_task:
+                            self._hedge_budget.wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _complete_batch(
+        self,
+        model: str,
+        prompts: List[str],
+        max_tokens: int,
+        temperature: float,
+    ) -> List[str]:
+        """
+        One /v1/completions call for many prompts — vLLM schedules them together.
+        Note: the legacy completions endpoint takes raw prompts, so the model's
+        chat template is not applied on this path.
+        """
+        backend = self._pick(model)
+        async with self._guard(backend, model), self._pool.acquire(backend=backend):
+            response = await backend.client.completions.create(
+                model=model,
+                prompt=prompts,
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+        texts = [""] * len(prompts)
+        for choice in response.choices:
+            texts[choice.index] = choice.text
+        return texts
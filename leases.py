@@ -0,0 +1,153 @@
+"""
+Per-User Concurrency Leases
+Caps how many requests and streams one caller (JWT `sub`) has in flight,
+across all replicas. Each slot is a lease in a Redis ZSET scored by its
+expiry; the holder's replica extends it with periodic heartbeats, so a
+crashed replica's slots free themselves after LEASE_TTL_SECS.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+from app.services.redis_client import redis_client
+
+USER_MAX_STREAMS = int(os.getenv("USER_MAX_STREAMS", "4"))      # concurrent /stream per user; 0 = no cap
+USER_MAX_REQUESTS = int(os.getenv("USER_MAX_REQUESTS", "16"))   # concurrent /complete per user; 0 = no cap
+# How long an excess request waits for a slot before 429 (0 = reject at once)
+USER_CONCURRENCY_QUEUE_MS = float(os.getenv("USER_CONCURRENCY_QUEUE_MS", "0"))
+LEASE_TTL_SECS = float(os.getenv("LEASE_TTL_SECS", "30"))
+LEASE_HEARTBEAT_SECS = LEASE_TTL_SECS / 3
+QUEUE_POLL_SECS = 0.1
+
+# KEYS[1] = lease ZSET; ARGV = now (ms), ttl (ms), limit, lease id.
+# Drops expired leases, then takes a slot if one is free. Returns {acquired, in use}.
+ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local count = redis.call('ZCARD', KEYS[1])
+if count >= tonumber(ARGV[3]) then
+    return {0, count}
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ttl)
+return {1, count + 1}
+"""
+
+
+class UserConcurrencyExceeded(Exception):
+    pass
+
+
+class Lease:
+    __slots__ = ("key", "member")
+
+    def __init__(self, key: str, member: str):
+        self.key = key
+        self.member = member
+
+
+class UserConcurrencyLimiter:
+    def __init__(
+        self,
+        max_streams: int = USER_MAX_STREAMS,
+        max_requests: int = USER_MAX_REQUESTS,
+        queue_ms: float = USER_CONCURRENCY_QUEUE_MS,
+        ttl: float = LEASE_TTL_SECS,
+    ):
+        self._limits = {"stream": max_streams, "request": max_requests}
+        self._queue_wait = queue_ms / 1000
+        self._ttl_ms = int(ttl * 1000)
+        self._held: Dict[str, Lease] = {}  # member -> lease, heartbeated until released
+        self._script = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.acquired = 0
+        self.queued = 0
+        self.rejected = 0
+
+    async def acquire(self, identifier: str, kind: str, timeout: Optional[float] = None) -> Optional[Lease]:
+        """
+        Take a "stream" or "request" slot for identifier, waiting up to the
+        queue time (capped by timeout) for one to free up. Raises
+        UserConcurrencyExceeded; returns None when uncapped or Redis is down.
+        """
+        limit = self._limits[kind]
+        if limit <= 0:
+            return None
+        lease = Lease(f"leases:{kind}:{identifier}", uuid.uuid4().hex)
+        wait = self._queue_wait if timeout is None else min(self._queue_wait, timeout)
+        give_up = time.monotonic() + wait
+        queued = False
+        while True:
+            try:
+                if self._script is None:
+                    self._script = redis_client.client.register_script(ACQUIRE_LUA)
+                acquired, _ = await self._script(
+                    keys=[lease.key],
+                    args=[int(time.time() * 1000), self._ttl_ms, limit, lease.member],
+                )
+            except Exception:
+                return None  # Fail open
+            if acquired:
+                self.acquired += 1
+                self._held[lease.member] = lease
+                return lease
+
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                self.rejected += 1
+                raise UserConcurrencyExceeded(f"Too many concurrent {kind}s (limit {limit})")
+            if not queued:
+                queued = True
+                self.queued += 1
+            await asyncio.sleep(min(QUEUE_POLL_SECS, remaining))
+
+    async def release(self, lease: Optional[Lease]) -> None:
+        """Give the slot back. Idempotent — safe from several cleanup paths."""
+        if lease is None or self._held.pop(lease.member, None) is None:
+            return
+        try:
+            await redis_client.client.zrem(lease.key, lease.member)
+        except Exception:
+            pass  # Expires on its own once heartbeats stop
+
+    async def start(self) -> None:
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        for lease in list(self._held.values()):
+            await self.release(lease)
+
+    def stats(self) -> dict:
+        return {
+            "held": len(self._held),
+            "acquired": self.acquired,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(LEASE_HEARTBEAT_SECS)
+            leases = list(self._held.values())
+            if not leases:
+                continue
+            expires = int(time.time() * 1000) + self._ttl_ms
+            try:
+                pipe = redis_client.client.pipeline(transaction=False)
+                for lease in leases:
+                    pipe.zadd(lease.key, {lease.member: expires}, xx=True)  # Only extend, never revive
+                    pipe.pexpire(lease.key, self._ttl_ms)
+                await pipe.execute()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass  # Retry next beat; a lease outlives two missed beats
@@ -0,0 +1,64 @@
+"""
+Local Cache Tier
+Bounded in-process LRU (by entry count and bytes) with per-entry expiry.
+Sits in front of Redis as an L1 for the handful of prompts that get most hits.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000"))
+L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class LocalCache:
+    def __init__(self, max_entries: int = L1_MAX_ENTRIES, max_bytes: int = L1_MAX_BYTES):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at, _ = item
+        if time.monotonic() >= expires_at:
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float, size: int) -> None:
+        """Store for `ttl` seconds; `size` is the entry's approximate byte cost."""
+        if ttl <= 0 or size > self._max_bytes:
+            return
+        self.delete(key)
+        self._data[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while len(self._data) > self._max_entries or self._bytes > self._max_bytes:
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item:
+            self._bytes -= item[2]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+        }
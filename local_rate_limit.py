@@ -0,0 +1,163 @@
+"""
+Local Rate Limiter
+Approximate distributed rate limiting without a Redis hop on the hot path.
+Each replica decides locally from an allowance per identifier; a background
+task pushes consumed counts to Redis in one pipeline per sync interval
+(INCRBY on a fixed-window counter) and reads global usage back from the
+replies. Identifiers with nothing to push are only re-read (GET) every
+RATE_LIMIT_IDLE_REFRESH_SYNCS syncs. Each replica's allowance is then its fair share of what's left:
+
+    allowance = (RATE_LIMIT * (1 + error bound) - global usage) / live replicas
+
+So all replicas together admit at most RATE_LIMIT * (1 + error bound) per
+window while the replica count is accurate. Live replicas are counted from
+heartbeats in a Redis ZSET. An identifier a replica hasn't synced yet this
+window starts with the fair share of the full ceiling, so traffic that moves
+between replicas mid-window can overshoot by up to one fair share per
+replica until the next sync.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from app.services.redis_client import redis_client
+
+RATE_LIMIT_SYNC_MS = float(os.getenv("RATE_LIMIT_SYNC_MS", "250"))
+# Allowed overshoot of the global limit, as a fraction (0 = never exceed, assuming
+# the replica count is accurate; larger = replicas can absorb skewed traffic)
+RATE_LIMIT_ERROR_BOUND = float(os.getenv("RATE_LIMIT_ERROR_BOUND", "0.1"))
+# Buckets with nothing to push only re-read global usage every this many syncs
+RATE_LIMIT_IDLE_REFRESH_SYNCS = max(1, int(os.getenv("RATE_LIMIT_IDLE_REFRESH_SYNCS", "8")))
+REPLICAS_KEY = "rate_limit_local:replicas"
+REPLICA_TIMEOUT_SECS = 10  # Heartbeats older than this don't count as live
+
+
+class _Bucket:
+    __slots__ = ("window", "global_used", "pending", "since_sync", "allowance")
+
+    def __init__(self, window: int, allowance: float):
+        self.window = window
+        self.global_used = 0  # As of the last sync, including our own pushes
+        self.pending = 0      # Consumed here, not yet pushed
+        self.since_sync = 0   # Consumed here since the allowance was computed
+        self.allowance = allowance
+
+
+class LocalRateLimiter:
+    def __init__(
+        self,
+        limit: int,
+        window_secs: int,
+        sync_ms: float = RATE_LIMIT_SYNC_MS,
+        error_bound: float = RATE_LIMIT_ERROR_BOUND,
+    ):
+        self._limit = limit
+        self._window = window_secs
+        self._sync_interval = sync_ms / 1000
+        self._ceiling = limit * (1 + error_bound)
+        self._replica = uuid.uuid4().hex
+        self._replicas = 1
+        self._buckets: Dict[str, _Bucket] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.syncs = 0
+        self.sync_failures = 0
+
+    def check(self, identifier: str) -> Tuple[bool, int, int]:
+        """Decide locally — no I/O. Returns (allowed, remaining, ms until the window resets)."""
+        now = time.time()
+        window = int(now // self._window)
+        bucket = self._buckets.get(identifier)
+        if bucket is None or bucket.window != window:
+            bucket = self._buckets[identifier] = _Bucket(window, self._ceiling / self._replicas)
+
+        reset_ms = int(((window + 1) * self._window - now) * 1000)
+        if bucket.since_sync + 1 > bucket.allowance:
+            return False, 0, reset_ms
+        bucket.pending += 1
+        bucket.since_sync += 1
+        remaining = self._limit - bucket.global_used - bucket.since_sync
+        return True, max(int(remaining), 0), reset_ms
+
+    async def start(self) -> None:
+        if self._task is None:
+            try:
+                await self._sync()  # Learn the replica count before taking traffic
+            except Exception:
+                self.sync_failures += 1
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self._sync()  # Push what's left so other replicas see it
+            await redis_client.client.zrem(REPLICAS_KEY, self._replica)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "replicas": self._replicas,
+            "tracked": len(self._buckets),
+            "pending": sum(b.pending for b in self._buckets.values()),
+            "syncs": self.syncs,
+            "sync_failures": self.sync_failures,
+        }
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._sync_interval)
+            try:
+                await self._sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Keep deciding on the last allowances until Redis is back
+                self.sync_failures += 1
+
+    async def _sync(self) -> None:
+        now = time.time()
+        window = int(now // self._window)
+        # Earlier windows are over — their counts no longer matter
+        self._buckets = {k: b for k, b in self._buckets.items() if b.window == window}
+        # Push only what was consumed; idle buckets just re-read usage now and then
+        refresh_idle = self.syncs % RATE_LIMIT_IDLE_REFRESH_SYNCS == 0
+        synced = [
+            (identifier, b, b.pending)
+            for identifier, b in self._buckets.items()
+            if b.pending > 0 or refresh_idle
+        ]
+
+        pipe = redis_client.client.pipeline(transaction=False)
+        pipe.zadd(REPLICAS_KEY, {self._replica: now})
+        pipe.zremrangebyscore(REPLICAS_KEY, "-inf", now - REPLICA_TIMEOUT_SECS)
+        pipe.zcard(REPLICAS_KEY)
+        for identifier, _, count in synced:
+            key = f"rate_limit_local:{identifier}:{window}"
+            if count:
+                pipe.incrby(key, count)
+                pipe.expire(key, self._window * 2)
+            else:
+                pipe.get(key)
+        results = await pipe.execute()
+
+        self._replicas = max(int(results[2]), 1)
+        replies = iter(results[3:])
+        for _, bucket, count in synced:
+            total = next(replies)
+            if count:
+                next(replies)  # EXPIRE
+                # Requests admitted while the pipeline was in flight stay pending/counted
+                bucket.pending -= count
+                bucket.since_sync -= count
+            bucket.global_used = int(total or 0)
+        # Re-share every bucket, so a replica count change reaches idle ones too
+        for bucket in self._buckets.values():
+            left = self._ceiling - bucket.global_used
+            bucket.allowance = max(left, 0) / self._replicas
+        self.syncs += 1
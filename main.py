@@ -3,14 +3,16 @@ AI Gateway - Main FastAPI Application
 Scalable entry point for your Python AI system.
 """
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.middleware.auth import AuthMiddleware
-from app.middleware.rate_limit import RateLimitMiddleware
+from app.middleware.rate_limit import RATE_LIMIT_MODE, RateLimitMiddleware, local_limiter
 from app.routers import inference, health, models
 from app.services.redis_client import redis_client
+from app.services.warmup import CACHE_WARMUP_FILE, CacheWarmer, load_corpus
 
 
 @asynccontextmanager
@@ -18,7 +20,29 @@ async def lifespan(app: FastAPI):
     """Startup & shutdown lifecycle."""
     await redis_client.connect()
     print("✅ Redis connected")
+    await inference.cache.start()
+    await inference.leases.start()
+    if RATE_LIMIT_MODE == "local":
+        await local_limiter.start()
+
+    # Warm the cache from the hot-prompt corpus; gate readiness on the warm fraction
+    warmup = None
+    if CACHE_WARMUP_FILE:
+        app.state.warmer = CacheWarmer(inference.cache, inference.engine)
+        warmup = asyncio.create_task(app.state.warmer.run(load_corpus(CACHE_WARMUP_FILE)))
+        if not await app.state.warmer.wait_ready():
+            print("⚠️ Cache warmup not at target fraction — serving anyway")
+
     yield
+    if warmup is not None:
+        warmup.cancel()
+        await asyncio.gather(warmup, return_exceptions=True)
+    if RATE_LIMIT_MODE == "local":
+        await local_limiter.stop()  # Final push of consumed counts
+    await inference.leases.stop()
+    await inference.refresher.stop()
+    await inference.cache.stop()
+    await inference.engine.aclose()
     await redis_client.disconnect()
     print("🛑 Redis disconnected")
 
@@ -0,0 +1,139 @@
+"""
+Priority Scheduling
+Maps callers to priority classes (JWT `role` claim, optionally lowered via
+the X-Priority header) and decides which queued upstream call gets the next
+free concurrency slot. Lower class number = more important.
+"""
+
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+PRIORITY_HEADER = "X-Priority"
+PRIORITY_MODE = os.getenv("PRIORITY_MODE", "weighted")  # "strict" | "weighted"
+# Starvation guard: a waiter queued this long is served next. Must be shorter
+# than the queue timeout or waiters give up before it kicks in; 0 (or a value
+# that isn't shorter) means half the queue timeout.
+PRIORITY_MAX_WAIT_MS = float(os.getenv("PRIORITY_MAX_WAIT_MS", "0"))
+
+
+def _parse_map(spec: str) -> Dict[str, int]:
+    """Parse "internal=0,premium=1" into {"internal": 0, "premium": 1}."""
+    mapping = {}
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        if name and value:
+            mapping[name] = int(value)
+    return mapping
+
+
+ROLE_PRIORITIES = _parse_map(os.getenv("ROLE_PRIORITIES", "internal=0,premium=1,user=2,batch=3"))
+DEFAULT_PRIORITY = ROLE_PRIORITIES.get("user", 2)
+BACKGROUND_PRIORITY = max(ROLE_PRIORITIES.values(), default=DEFAULT_PRIORITY)  # cache refreshes etc.
+# Share of dequeues each class gets under "weighted" mode when all are backlogged
+PRIORITY_WEIGHTS = {
+    int(k): v for k, v in _parse_map(os.getenv("PRIORITY_WEIGHTS", "0=8,1=4,2=2,3=1")).items()
+}
+
+
+def priority_for(user: Optional[dict], requested: Optional[str] = None) -> int:
+    """
+    Priority class for a caller. A request may ask for a lower priority
+    (higher number, by class number or role name) but never a higher one.
+    """
+    base = ROLE_PRIORITIES.get((user or {}).get("role"), DEFAULT_PRIORITY)
+    if not requested:
+        return base
+    if requested in ROLE_PRIORITIES:
+        return max(base, ROLE_PRIORITIES[requested])
+    try:
+        return max(base, int(requested))
+    except ValueError:
+        return base
+
+
+def starvation_wait(queue_timeout: float) -> float:
+    """Max wait (seconds) for a queue whose waiters time out after queue_timeout."""
+    configured = PRIORITY_MAX_WAIT_MS / 1000
+    if 0 < configured < queue_timeout:
+        return configured
+    return queue_timeout / 2
+
+
+class _Entry:
+    __slots__ = ("enqueued_at", "item")
+
+    def __init__(self, item):
+        self.enqueued_at = time.monotonic()
+        self.item = item
+
+
+class PriorityQueue:
+    """
+    Per-class FIFO queues. `strict` always serves the most important class;
+    `weighted` uses smooth weighted round-robin across backlogged classes.
+    Either way, a waiter older than max_wait is served first — see
+    starvation_wait() for picking one below the queue timeout.
+    """
+
+    def __init__(
+        self,
+        max_wait: float,
+        mode: str = PRIORITY_MODE,
+        weights: Dict[int, int] = PRIORITY_WEIGHTS,
+    ):
+        self._mode = mode
+        self._weights = weights
+        self._max_wait = max_wait
+        self._queues: Dict[int, Deque[_Entry]] = {}
+        self._current: Dict[int, int] = {}  # Smooth-WRR running credit per class
+        self._size = 0
+        self.promoted = 0  # Served early by the starvation guard
+
+    def push(self, priority: int, item) -> None:
+        self._queues.setdefault(priority, deque()).append(_Entry(item))
+        self._size += 1
+
+    def pop(self):
+        """Next item to serve, or None when empty."""
+        backlogged = [p for p, q in self._queues.items() if q]
+        if not backlogged:
+            return None
+
+        oldest = min(backlogged, key=lambda p: self._queues[p][0].enqueued_at)
+        if time.monotonic() - self._queues[oldest][0].enqueued_at >= self._max_wait:
+            self.promoted += 1
+            chosen = oldest
+        elif self._mode == "strict":
+            chosen = min(backlogged)
+        else:
+            chosen = self._weighted_pick(backlogged)
+
+        self._size -= 1
+        return self._queues[chosen].popleft().item
+
+    def remove(self, item) -> bool:
+        for queue in self._queues.values():
+            for entry in queue:
+                if entry.item is item:
+                    queue.remove(entry)
+                    self._size -= 1
+                    return True
+        return False
+
+    def depth_by_class(self) -> Dict[int, int]:
+        return {p: len(q) for p, q in sorted(self._queues.items()) if q}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _weighted_pick(self, backlogged: List[int]) -> int:
+        total = 0
+        for p in backlogged:
+            weight = self._weights.get(p, 1)
+            self._current[p] = self._current.get(p, 0) + weight
+            total += weight
+        chosen = max(backlogged, key=lambda p: (self._current[p], -p))
+        self._current[chosen] -= total
+        return chosen
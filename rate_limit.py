@@ -1,18 +1,87 @@
 """
 Rate Limit Middleware
-Sliding-window rate limiter backed by Redis.
-Default: 60 requests / minute per user/IP.
+Redis-backed rate limiter, default 60 requests / minute per user/IP.
+RATE_LIMIT_MODE picks the algorithm:
+  sliding — exact sliding-window log (one ZSET member per request)
+  gcra    — generic cell rate algorithm (one timestamp per key, with burst)
+  local   — approximate: in-process decisions, reconciled with Redis in the
+            background (see local_rate_limit.py)
+The Redis modes run as one server-side Lua script (one atomic round trip).
 """
 
+import math
+import os
 import time
+import uuid
+from typing import Dict, NamedTuple
+
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
 from fastapi import Request
 
+from app.middleware.local_rate_limit import LocalRateLimiter
 from app.services.redis_client import redis_client
 
 RATE_LIMIT = 60       # max requests
 WINDOW_SECS = 60      # per minute
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "sliding")  # "sliding" | "gcra" | "local"
+# GCRA only: requests allowed back-to-back from idle (defaults to a full window's worth)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", str(RATE_LIMIT)))
+# Separate key spaces — the modes store different Redis types
+KEY_PREFIXES = {"sliding": "rate_limit", "gcra": "rate_limit_gcra"}
+
+# KEYS[1] = window ZSET; ARGV = now (ms), window (ms), limit, unique member.
+# Members are only added for allowed requests, so rejections don't extend the ban.
+# Returns {allowed, remaining, ms until the oldest request leaves the window}.
+SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    count = count + 1
+    allowed = 1
+end
+local reset = window
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed, limit - count, reset}
+"""
+
+# KEYS[1] = theoretical arrival time (ms); ARGV = now (ms), emission interval (ms), burst.
+# Returns {allowed, remaining, ms until a slot frees up if rejected / until fully replenished}.
+GCRA_LUA = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local allow_at = new_tat - interval * burst
+if now < allow_at then
+    return {0, 0, math.ceil(allow_at - now)}
+end
+local ttl = math.ceil(new_tat - now)
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', ttl)
+return {1, math.floor((now - allow_at) / interval), ttl}
+"""
+
+_scripts: Dict[str, object] = {}  # redis-py Scripts (EVALSHA, re-load themselves on NOSCRIPT)
+local_limiter = LocalRateLimiter(RATE_LIMIT, WINDOW_SECS)  # Started by the lifespan in "local" mode
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    reset_ms: int  # Until a slot frees up (GCRA: until fully replenished, when allowed)
 
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
@@ -24,43 +93,58 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         # Identify by user ID if auth'd, else by IP
         user = getattr(request.state, "user", None)
         identifier = user.get("sub") if user else request.client.host
-        key = f"rate_limit:{identifier}"
+        key = f"{KEY_PREFIXES.get(RATE_LIMIT_MODE, 'rate_limit')}:{identifier}"
 
         try:
-            allowed = await _check_rate_limit(key)
+            if RATE_LIMIT_MODE == "local":
+                result = RateLimitResult(*local_limiter.check(identifier))
+            else:
+                result = await _check_rate_limit(key)
         except Exception:
             # If Redis is down, fail open (don't block users)
-            allowed = True
+            return await call_next(request)
 
-        if not allowed:
+        headers = {
+            "X-RateLimit-Limit": str(RATE_LIMIT_BURST if RATE_LIMIT_MODE == "gcra" else RATE_LIMIT),
+            "X-RateLimit-Remaining": str(max(result.remaining, 0)),
+            "X-RateLimit-Reset": str(math.ceil(result.reset_ms / 1000)),
+        }
+        if not result.allowed:
             return JSONResponse(
                 status_code=429,
                 content={
-                    "detail": "Rate limit exceeded. Try again in a minute.",
+                    "detail": "Rate limit exceeded. Try again later.",
                     "limit": RATE_LIMIT,
                     "window_seconds": WINDOW_SECS,
                 },
-                headers={"Retry-After": str(WINDOW_SECS)},
+                headers={**headers, "Retry-After": headers["X-RateLimit-Reset"]},
             )
 
-        return await call_next(request)
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
 
 
-async def _check_rate_limit(key: str) -> bool:
-    """
-    Sliding window counter using Redis.
-    Returns True if request is allowed, False if limit exceeded.
-    """
-    client = redis_client.client
-    now = int(time.time())
-    window_start = now - WINDOW_SECS
+def _script(lua: str):
+    if lua not in _scripts:
+        _scripts[lua] = redis_client.client.register_script(lua)
+    return _scripts[lua]
 
-    pipe = client.pipeline()
-    pipe.zremrangebyscore(key, 0, window_start)   # Remove old entries
-    pipe.zadd(key, {str(now): now})               # Add current request
-    pipe.zcard(key)                                # Count requests in window
-    pipe.expire(key, WINDOW_SECS + 1)             # Auto-cleanup
-    results = await pipe.execute()
 
-    request_count = results[2]
-    return request_count <= RATE_LIMIT
+async def _check_rate_limit(key: str, mode: str = RATE_LIMIT_MODE) -> RateLimitResult:
+    """One EVALSHA per request, in the configured mode."""
+    now_ms = int(time.time() * 1000)
+    if mode == "gcra":
+        reply = await _script(GCRA_LUA)(
+            keys=[key],
+            args=[now_ms, WINDOW_SECS * 1000 / RATE_LIMIT, RATE_LIMIT_BURST],
+        )
+    else:
+        # Sliding window log: millisecond scores and unique members, so bursts
+        # within the same second are all counted
+        reply = await _script(SLIDING_WINDOW_LUA)(
+            keys=[key],
+            args=[now_ms, WINDOW_SECS * 1000, RATE_LIMIT, f"{now_ms}-{uuid.uuid4().hex[:12]}"],
+        )
+    allowed, remaining, reset_ms = reply
+    return RateLimitResult(bool(allowed), int(remaining), int(reset_ms))
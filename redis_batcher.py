@@ -0,0 +1,138 @@
+"""
+Redis Auto-Batching
+Collects cache reads issued within the same event-loop tick (or a short
+window) into one MGET, and cache writes into one pipelined SET batch, so
+Redis sees a few large commands instead of thousands of tiny ones.
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.services.redis_client import redis_client
+
+REDIS_BATCH_WINDOW_MS = float(os.getenv("REDIS_BATCH_WINDOW_MS", "0"))  # 0 = flush on the next loop tick
+REDIS_BATCH_MAX_SIZE = int(os.getenv("REDIS_BATCH_MAX_SIZE", "256"))    # flush early when full
+
+SetItem = Tuple[str, Any, int]  # (key, value, ttl seconds)
+_Write = Tuple[List[SetItem], Optional[Tuple[str, str]], asyncio.Future]
+
+
+class RedisBatcher:
+    def __init__(
+        self,
+        window_ms: float = REDIS_BATCH_WINDOW_MS,
+        max_size: int = REDIS_BATCH_MAX_SIZE,
+    ):
+        self._window = window_ms / 1000
+        self._max_size = max_size
+        self._gets: Dict[str, List[asyncio.Future]] = {}
+        self._writes: List[_Write] = []
+        self._get_timer: Optional[asyncio.Handle] = None
+        self._write_timer: Optional[asyncio.Handle] = None
+        self._dispatching: Set[asyncio.Task] = set()
+        self._get_calls = 0
+        self._get_batches = 0
+        self._write_calls = 0
+        self._write_batches = 0
+
+    async def get(self, key: str) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._gets.setdefault(key, []).append(future)
+        self._get_calls += 1
+        if len(self._gets) >= self._max_size:
+            self._flush_gets()
+        elif self._get_timer is None:
+            self._get_timer = self._schedule(self._flush_gets)
+        return await future
+
+    async def set(self, *items: SetItem, publish: Optional[Tuple[str, str]] = None) -> None:
+        """SET each (key, value, ttl), then optionally PUBLISH (channel, message) — in that order."""
+        future = asyncio.get_running_loop().create_future()
+        self._writes.append((list(items), publish, future))
+        self._write_calls += 1
+        if len(self._writes) >= self._max_size:
+            self._flush_writes()
+        elif self._write_timer is None:
+            self._write_timer = self._schedule(self._flush_writes)
+        await future
+
+    async def close(self) -> None:
+        """Flush anything queued and wait for in-flight batches."""
+        self._flush_gets()
+        self._flush_writes()
+        await asyncio.gather(*self._dispatching, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "get_calls": self._get_calls,
+            "get_batches": self._get_batches,
+            "avg_get_batch": round(self._get_calls / self._get_batches, 2) if self._get_batches else 0.0,
+            "write_calls": self._write_calls,
+            "write_batches": self._write_batches,
+            "avg_write_batch": round(self._write_calls / self._write_batches, 2) if self._write_batches else 0.0,
+        }
+
+    def _schedule(self, flush) -> asyncio.Handle:
+        loop = asyncio.get_running_loop()
+        if self._window <= 0:
+            return loop.call_soon(flush)
+        return loop.call_later(self._window, flush)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._dispatching.add(task)  # Keep a reference until it finishes
+        task.add_done_callback(self._dispatching.discard)
+
+    def _flush_gets(self) -> None:
+        if self._get_timer is not None:
+            self._get_timer.cancel()
+            self._get_timer = None
+        batch, self._gets = self._gets, {}
+        if batch:
+            self._spawn(self._dispatch_gets(batch))
+
+    def _flush_writes(self) -> None:
+        if self._write_timer is not None:
+            self._write_timer.cancel()
+            self._write_timer = None
+        batch, self._writes = self._writes, []
+        if batch:
+            self._spawn(self._dispatch_writes(batch))
+
+    async def _dispatch_gets(self, batch: Dict[str, List[asyncio.Future]]) -> None:
+        self._get_batches += 1
+        keys = list(batch)
+        try:
+            values = await redis_client.client.mget(keys)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for key, value in zip(keys, values):
+            for future in batch[key]:
+                if not future.done():  # Caller may have timed out meanwhile
+                    future.set_result(value)
+
+    async def _dispatch_writes(self, batch: List[_Write]) -> None:
+        self._write_batches += 1
+        try:
+            pipe = redis_client.client.pipeline(transaction=False)
+            for items, publish, _ in batch:
+                for key, value, ttl in items:
+                    pipe.set(key, value, ex=ttl)
+                if publish:
+                    pipe.publish(*publish)
+            await pipe.execute()
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
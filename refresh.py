@@ -0,0 +1,63 @@
+"""
+Background Refresh
+Regenerates stale cache entries off the request path (stale-while-revalidate).
+At most one refresh per key is pending, and refresh concurrency is bounded
+so a wave of soft expiries can't flood upstream.
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict
+
+REFRESH_CONCURRENCY = int(os.getenv("CACHE_REFRESH_CONCURRENCY", "4"))
+REFRESH_MAX_PENDING = int(os.getenv("CACHE_REFRESH_MAX_PENDING", "256"))
+
+
+class BackgroundRefresher:
+    def __init__(
+        self,
+        concurrency: int = REFRESH_CONCURRENCY,
+        max_pending: int = REFRESH_MAX_PENDING,
+    ):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_pending = max_pending
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0  # Duplicate key, or backlog full
+
+    def schedule(self, key: str, refresh: Callable[[], Awaitable[None]]) -> bool:
+        if key in self._pending or len(self._pending) >= self._max_pending:
+            self.skipped += 1
+            return False
+        self.scheduled += 1
+        self._pending[key] = asyncio.ensure_future(self._run(key, refresh))
+        return True
+
+    async def stop(self) -> None:
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "pending": len(self._pending),
+        }
+
+    async def _run(self, key: str, refresh: Callable[[], Awaitable[None]]) -> None:
+        try:
+            async with self._semaphore:
+                await refresh()
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1  # Entry stays stale until its hard TTL — nothing to undo
+        finally:
+            self._pending.pop(key, None)
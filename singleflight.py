@@ -0,0 +1,90 @@
+"""
+Single-Flight Service
+Coalesces concurrent identical calls so only one of them reaches upstream.
+Followers await the leader's result instead of issuing their own call.
+Each waiter waits for its own deadline; the call itself has no fixed cap,
+but is cancelled as soon as nobody is waiting for it any more.
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.services.deadline import MAX_REQUEST_TIMEOUT
+
+# Wait for callers without a deadline of their own (e.g. background refreshes)
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", str(MAX_REQUEST_TIMEOUT)))
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, timeout: float = SINGLEFLIGHT_TIMEOUT):
+        self._timeout = timeout
+        self._flights: Dict[str, _Flight] = {}
+        self._coalesced = 0
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        Run fn() at most once per key at a time.
+        Returns (result, shared) — shared is True for followers.
+        The leader's exception is raised in every waiter; each waiter gives up
+        (asyncio.TimeoutError) after its own timeout, or the default without one.
+        When the last waiter gives up, the call is cancelled.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            task = asyncio.ensure_future(fn())
+            flight = _Flight(task)
+            self._flights[key] = flight
+            task.add_done_callback(lambda t: self._forget(key, flight))
+        else:
+            self._coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # Shield so one waiter giving up doesn't cancel the call for the rest
+            result = await asyncio.wait_for(
+                asyncio.shield(flight.task), self._timeout if timeout is None else timeout
+            )
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to use the answer — stop generating it, and let
+                # the next caller start afresh rather than join a dying call
+                self._forget(key, flight)
+                flight.task.cancel()
+        return result, shared
+
+    def pending(self, key: str) -> bool:
+        """Whether a call for key is running — do() would follow rather than lead."""
+        return key in self._flights
+
+    def waiters(self, key: str) -> int:
+        flight = self._flights.get(key)
+        return flight.waiters if flight else 0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(f.waiters for f in self._flights.values()),
+            "coalesced": self._coalesced,
+        }
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.task.done() and not flight.task.cancelled():
+            flight.task.exception()  # Mark retrieved even if every waiter left
@@ -0,0 +1,158 @@
+"""
+Token Quota Service
+Per-user quotas on LLM tokens rather than requests. Admission reserves an
+estimate (prompt length + max_tokens) against per-minute and per-day windows
+in one Lua call; once the completion finishes the reservation is settled to
+the tokens actually used (or refunded entirely, e.g. for coalesced calls).
+"""
+
+import math
+import os
+import time
+from typing import List, Optional
+
+from app.services.redis_client import redis_client
+
+TOKEN_QUOTA_PER_MINUTE = int(os.getenv("TOKEN_QUOTA_PER_MINUTE", "40000"))   # 0 = no minute quota
+TOKEN_QUOTA_PER_DAY = int(os.getenv("TOKEN_QUOTA_PER_DAY", "1000000"))       # 0 = no daily quota
+CHARS_PER_TOKEN = 4  # Rough estimate when no tokenizer is at hand
+WINDOWS = (60, 86400)
+
+# KEYS = minute counter, day counter; ARGV = amount, minute limit, day limit.
+# Reserves on both or neither. Returns {allowed, exhausted window (0/1/2),
+# minute remaining, day remaining} with -1 for an unlimited window.
+RESERVE_LUA = """
+local amount = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local ttls = {60, 86400}
+local used = {}
+for i = 1, 2 do
+    used[i] = tonumber(redis.call('GET', KEYS[i]) or '0')
+end
+for i = 1, 2 do
+    if limits[i] > 0 and used[i] + amount > limits[i] then
+        return {0, i, limits[1] > 0 and limits[1] - used[1] or -1, limits[2] > 0 and limits[2] - used[2] or -1}
+    end
+end
+for i = 1, 2 do
+    used[i] = redis.call('INCRBY', KEYS[i], amount)
+    if redis.call('TTL', KEYS[i]) < 0 then
+        redis.call('EXPIRE', KEYS[i], ttls[i] + 60)
+    end
+end
+return {1, 0, limits[1] > 0 and limits[1] - used[1] or -1, limits[2] > 0 and limits[2] - used[2] or -1}
+"""
+
+# KEYS = the reservation's counters; ARGV[1] = delta. Windows that already
+# rolled over are left alone (don't recreate them without a TTL).
+SETTLE_LUA = """
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('INCRBY', KEYS[i], ARGV[1])
+    end
+end
+return 1
+"""
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(Exception):
+    """The request alone needs more tokens than a quota window holds — retrying can't help."""
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class Reservation:
+    __slots__ = ("keys", "reserved", "remaining", "settled")
+
+    def __init__(self, keys: List[str], reserved: int, remaining: List[int]):
+        self.keys = keys
+        self.reserved = reserved
+        self.remaining = remaining  # [minute, day], -1 = unlimited
+        self.settled = False
+
+
+class TokenQuota:
+    def __init__(
+        self,
+        per_minute: int = TOKEN_QUOTA_PER_MINUTE,
+        per_day: int = TOKEN_QUOTA_PER_DAY,
+    ):
+        self._limits = (per_minute, per_day)
+        self._reserve = None
+        self._settle = None
+        self.rejected = 0
+        self.reconciled_tokens = 0  # Net tokens handed back by settlements
+
+    @property
+    def enabled(self) -> bool:
+        return any(self._limits)
+
+    async def reserve(self, identifier: str, prompt: str, max_tokens: int) -> Optional[Reservation]:
+        """
+        Reserve estimated tokens, or raise QuotaExceeded (RequestTooLarge if
+        no window could ever fit it). Returns None when quotas are off or
+        Redis is unavailable (fail open).
+        """
+        if not self.enabled:
+            return None
+        amount = estimate_tokens(prompt) + int(max_tokens)
+        for limit, name in zip(self._limits, ("per-minute", "daily")):
+            if 0 < limit < amount:
+                self.rejected += 1
+                raise RequestTooLarge(f"Request needs ~{amount} tokens, more than the {name} token quota")
+        now = time.time()
+        keys = [
+            f"token_quota:{identifier}:{window}:{int(now // window)}" for window in WINDOWS
+        ]
+        try:
+            if self._reserve is None:
+                self._reserve = redis_client.client.register_script(RESERVE_LUA)
+            allowed, exhausted, minute_left, day_left = await self._reserve(
+                keys=keys, args=[amount, *self._limits]
+            )
+        except Exception:
+            return None
+
+        if not allowed:
+            self.rejected += 1
+            window = WINDOWS[int(exhausted) - 1]
+            name = "per-minute" if window == 60 else "daily"
+            retry_after = window - now % window
+            raise QuotaExceeded(f"{name.capitalize()} token quota exhausted", retry_after)
+        return Reservation(keys, amount, [int(minute_left), int(day_left)])
+
+    async def settle(self, reservation: Optional[Reservation], used_tokens: int) -> None:
+        """Replace the estimate with actual usage. Safe to call more than once."""
+        if reservation is None or reservation.settled:
+            return
+        reservation.settled = True
+        delta = int(used_tokens) - reservation.reserved
+        if delta == 0:
+            return
+        try:
+            if self._settle is None:
+                self._settle = redis_client.client.register_script(SETTLE_LUA)
+            await self._settle(keys=reservation.keys, args=[delta])
+            self.reconciled_tokens -= delta
+        except Exception:
+            pass  # Over-reservation just expires with the window
+
+    async def refund(self, reservation: Optional[Reservation]) -> None:
+        """Hand the whole reservation back (nothing reached upstream for this caller)."""
+        await self.settle(reservation, 0)
+
+    def stats(self) -> dict:
+        return {
+            "per_minute": self._limits[0],
+            "per_day": self._limits[1],
+            "rejected": self.rejected,
+            "reconciled_tokens": self.reconciled_tokens,
+        }
@@ -0,0 +1,169 @@
+"""
+Upstream Pool Service
+Spreads inference calls across several OpenAI-compatible backends (e.g. vLLM
+GPU nodes), always picking the least-loaded one by in-flight count and
+latency EWMA. Backends can be added or removed while requests are running.
+"""
+
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from openai import AsyncOpenAI
+
+# "http://gpu1:8000/v1=2,http://gpu2:8000/v1=1" — weight defaults to 1
+VLLM_BACKENDS = os.getenv("VLLM_BACKENDS", "")
+EWMA_ALPHA = float(os.getenv("UPSTREAM_EWMA_ALPHA", "0.2"))
+LATENCY_WINDOW = int(os.getenv("UPSTREAM_LATENCY_WINDOW", "200"))  # samples kept for percentiles
+DEFAULT_LATENCY = 1.0  # seconds — assumed until a backend has been sampled
+
+
+def parse_backends(spec: str) -> List[Tuple[str, float]]:
+    """Parse "url=weight,url" into [(url, weight), ...]."""
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.rpartition("=") if "=" in item else (item, "", "1")
+        backends.append((url.strip(), float(weight or 1)))
+    return backends
+
+
+def _ewma(current: float, sample: float) -> float:
+    return sample if current == 0.0 else current + EWMA_ALPHA * (sample - current)
+
+
+def _percentile(samples: deque, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Backend:
+    def __init__(self, url: str, client: AsyncOpenAI, weight: float = 1.0):
+        self.url = url
+        self.client = client
+        self.weight = weight
+        self.in_flight = 0
+        self.ewma_latency = 0.0  # seconds, 0 until the first sample
+        self.ewma_ttfb = 0.0     # streams only — kept apart from completion latency
+        self.draining = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._ttfbs = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, latency: float) -> None:
+        """Full-completion latency; drives the score, hedging and deadline checks."""
+        self._latencies.append(latency)
+        self.ewma_latency = _ewma(self.ewma_latency, latency)
+
+    def record_ttfb(self, ttfb: float) -> None:
+        """Stream time-to-first-byte. Reported only — it isn't comparable to a completion."""
+        self._ttfbs.append(ttfb)
+        self.ewma_ttfb = _ewma(self.ewma_ttfb, ttfb)
+
+    def percentile(self, q: float) -> float:
+        """Rolling latency percentile in seconds (0.0 until sampled)."""
+        return _percentile(self._latencies, q)
+
+    def ttfb_percentile(self, q: float) -> float:
+        return _percentile(self._ttfbs, q)
+
+    def score(self, fallback_latency: float) -> float:
+        """Expected wait if we send one more request here — lower is better."""
+        latency = self.ewma_latency or fallback_latency
+        return (self.in_flight + 1) * latency / self.weight
+
+    def stats(self) -> dict:
+        return {
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 2),
+            "p95_latency_ms": round(self.percentile(0.95) * 1000, 2),
+            "ewma_ttfb_ms": round(self.ewma_ttfb * 1000, 2),
+            "p95_ttfb_ms": round(self.ttfb_percentile(0.95) * 1000, 2),
+            "draining": self.draining,
+        }
+
+
+class UpstreamPool:
+    def __init__(
+        self,
+        client_factory: Callable[[str], AsyncOpenAI],
+        owns_clients: bool = True,
+    ):
+        self._client_factory = client_factory
+        self._owns_clients = owns_clients  # False when clients share one transport
+        self._backends: Dict[str, Backend] = {}
+
+    def add(self, url: str, weight: float = 1.0) -> Backend:
+        """Add a backend, or update the weight of an existing one."""
+        backend = self._backends.get(url)
+        if backend:
+            backend.weight = weight
+            return backend
+        backend = Backend(url, self._client_factory(url), weight)
+        self._backends[url] = backend
+        return backend
+
+    async def remove(self, url: str) -> None:
+        """
+        Stop routing new requests to a backend.
+        In-flight requests finish normally; the client closes after the last one.
+        """
+        backend = self._backends.pop(url, None)
+        if not backend:
+            return
+        backend.draining = True
+        if backend.in_flight == 0:
+            await self._close(backend)
+
+    def pick(self, exclude: Iterable[str] = ()) -> Backend:
+        candidates = [b for url, b in self._backends.items() if url not in exclude]
+        if not candidates:
+            raise RuntimeError("No upstream backends available")
+        sampled = [b.ewma_latency for b in candidates if b.ewma_latency]
+        fallback = sum(sampled) / len(sampled) if sampled else DEFAULT_LATENCY
+        return min(candidates, key=lambda b: b.score(fallback))
+
+    @asynccontextmanager
+    async def acquire(
+        self,
+        exclude: Iterable[str] = (),
+        record_latency: bool = True,
+        backend: Optional[Backend] = None,
+    ) -> AsyncIterator[Backend]:
+        """
+        Pick a backend (unless one is given) and count the request against it
+        for the block's duration. Latency is recorded on success unless the
+        caller samples it itself (streams record time-to-first-byte separately,
+        via record_ttfb).
+        """
+        backend = backend or self.pick(exclude)
+        backend.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield backend
+            if record_latency:
+                backend.record(time.monotonic() - start)
+        finally:
+            backend.in_flight -= 1
+            if backend.draining and backend.in_flight == 0:
+                await self._close(backend)
+
+    def __len__(self) -> int:
+        return len(self._backends)
+
+    def stats(self) -> dict:
+        return {url: b.stats() for url, b in self._backends.items()}
+
+    async def close(self) -> None:
+        for url in list(self._backends):
+            await self.remove(url)
+
+    async def _close(self, backend: Backend) -> None:
+        if self._owns_clients:
+            await backend.client.close()
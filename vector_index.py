@@ -0,0 +1,198 @@
+"""
+Vector Index
+Embedding functions and a local nearest-neighbour index for the semantic
+cache mode. Brute-force NumPy search for small sets; beyond a threshold the
+index switches to IVF (k-means coarse clusters, only the closest few are
+scanned). No external vector DB — vectors are persisted in Redis by the cache.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from openai import AsyncOpenAI
+
+EMBED_DIM = int(os.getenv("CACHE_EMBED_DIM", "256"))
+IVF_THRESHOLD = int(os.getenv("CACHE_IVF_THRESHOLD", "20000"))  # vectors before switching to IVF
+IVF_NPROBE = int(os.getenv("CACHE_IVF_NPROBE", "8"))             # clusters scanned per query
+KMEANS_ITERS = 8
+PRUNE_EVERY = 1000  # adds between sweeps of expired vectors
+
+_WORD = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Deterministic CPU-only embedding: hashed word unigrams + character
+    trigrams, L2-normalised. Identical across processes, so replicas can
+    share persisted vectors — but it measures spelling, not meaning, so it's
+    for tests only (see CACHE_ALLOW_HASH_EMBEDDER).
+    """
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+
+    async def embed(self, text: str) -> np.ndarray:
+        return self.embed_sync(text)
+
+    def embed_sync(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = " ".join(text.lower().split())
+        features = _WORD.findall(text) + [text[i:i + 3] for i in range(len(text) - 2)]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            vector[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        return _normalize(vector)
+
+
+class OpenAIEmbedder:
+    """Embeddings from an OpenAI-compatible /v1/embeddings endpoint."""
+
+    def __init__(self, client: AsyncOpenAI, model: str = "text-embedding-3-small", dim: int = EMBED_DIM):
+        self._client = client
+        self._model = model
+        self.dim = dim
+
+    async def embed(self, text: str) -> np.ndarray:
+        response = await self._client.embeddings.create(
+            model=self._model, input=text, dimensions=self.dim
+        )
+        return _normalize(np.asarray(response.data[0].embedding, dtype=np.float32))
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over normalised vectors, keyed by cache key.
+    Rows live in one matrix (swap-with-last on delete); in IVF mode each row
+    also carries its cluster assignment.
+    """
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+        self._vectors = np.zeros((1024, dim), dtype=np.float32)
+        self._expires = np.zeros(1024, dtype=np.float64)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.zeros(1024, dtype=np.int32)
+        self._trained_size = 0
+        self._version = 0  # Bumped on delete — invalidates an in-progress training
+        self._training = False
+        self._adds = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def add(self, key: str, vector: np.ndarray, ttl: float) -> None:
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._vectors):
+                self._grow()
+            self._ids.append(key)
+            self._rows[key] = row
+        self._vectors[row] = vector
+        self._expires[row] = time.monotonic() + ttl
+        if self._centroids is not None:
+            self._assign[row] = int(np.argmax(self._centroids @ vector))
+
+        self._adds += 1
+        if self._adds % PRUNE_EVERY == 0:
+            self.prune()
+
+    def remove(self, key: str) -> None:
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._ids[row] = moved
+            self._rows[moved] = row
+            self._vectors[row] = self._vectors[last]
+            self._expires[row] = self._expires[last]
+            self._assign[row] = self._assign[last]
+        self._ids.pop()
+        self._version += 1
+
+    def prune(self) -> None:
+        now = time.monotonic()
+        for row in np.nonzero(self._expires[:len(self._ids)] <= now)[0][::-1]:
+            self.remove(self._ids[row])
+
+    def search(self, vector: np.ndarray) -> Optional[Tuple[str, float]]:
+        """Best (key, cosine similarity) among live vectors, or None."""
+        n = len(self._ids)
+        if n == 0:
+            return None
+        if self._centroids is None:
+            rows = np.arange(n)
+        else:
+            probe = np.argsort(self._centroids @ vector)[-IVF_NPROBE:]
+            rows = np.nonzero(np.isin(self._assign[:n], probe))[0]
+            if len(rows) == 0:
+                return None
+
+        scores = self._vectors[rows] @ vector
+        scores[self._expires[rows] <= time.monotonic()] = -np.inf
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            return None
+        return self._ids[rows[best]], float(scores[best])
+
+    # --- IVF training ---
+
+    def needs_training(self) -> bool:
+        n = len(self._ids)
+        return not self._training and n >= IVF_THRESHOLD and n >= 2 * self._trained_size
+
+    async def train(self) -> None:
+        """Re-cluster off the event loop; applied only if no rows were deleted meanwhile."""
+        self._training = True
+        try:
+            n, version = len(self._ids), self._version
+            snapshot = self._vectors[:n].copy()
+            centroids, assign = await asyncio.to_thread(_kmeans, snapshot, int(np.sqrt(n)))
+            if version != self._version:
+                return  # Rows moved under us — try again on a later add
+            self._centroids = centroids
+            self._assign[:n] = assign
+            tail = len(self._ids)
+            if tail > n:  # Rows added while training
+                self._assign[n:tail] = np.argmax(self._vectors[n:tail] @ centroids.T, axis=1)
+            self._trained_size = n
+        finally:
+            self._training = False
+
+    def _grow(self) -> None:
+        size = len(self._vectors) * 2
+        self._vectors = np.resize(self._vectors, (size, self.dim))
+        self._expires = np.resize(self._expires, size)
+        self._assign = np.resize(self._assign, size)
+
+
+def _kmeans(data: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means on a sample, then assign every row. Runs in a thread."""
+    rng = np.random.default_rng(0)
+    sample = data[rng.choice(len(data), min(len(data), 64 * k), replace=False)]
+    centroids = sample[rng.choice(len(sample), k, replace=False)]
+    for _ in range(KMEANS_ITERS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(k):
+            members = sample[labels == c]
+            if len(members):
+                centroids[c] = _normalize(members.mean(axis=0))
+    return centroids, np.argmax(data @ centroids.T, axis=1).astype(np.int32)
@@ -0,0 +1,203 @@
+"""
+Cache Warmup
+Pre-populates the cache (Redis + the in-process tier) from a JSONL corpus of
+hot prompts after a deploy or Redis flush. One object per line:
+
+    {"prompt": "...", "model": "gpt-4o-mini", "max_tokens": 256,
+     "temperature": 0.2, "response": "..."}
+
+max_tokens/temperature default like InferenceEngine.generate. Lines with a
+"response" (exported entries) are written as-is; the rest are looked up and,
+if missing, regenerated upstream at a bounded rate. Warmed entries bypass
+the cache admission policy — the corpus already says they're hot.
+
+Run standalone with: python -m app.services.warmup corpus.jsonl
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+from app.services.priority import BACKGROUND_PRIORITY
+
+CACHE_WARMUP_FILE = os.getenv("CACHE_WARMUP_FILE", "")
+CACHE_WARMUP_CONCURRENCY = int(os.getenv("CACHE_WARMUP_CONCURRENCY", "8"))
+CACHE_WARMUP_RATE = float(os.getenv("CACHE_WARMUP_RATE", "2"))  # upstream regenerations/sec; 0 = none
+# Startup waits until this fraction of the corpus is warm (0 = don't wait)
+CACHE_WARMUP_READY_FRACTION = float(os.getenv("CACHE_WARMUP_READY_FRACTION", "0"))
+CACHE_WARMUP_READY_TIMEOUT = float(os.getenv("CACHE_WARMUP_READY_TIMEOUT", "120"))  # seconds
+
+
+def load_corpus(path: str) -> List[dict]:
+    """Parse the corpus, skipping blank or malformed lines."""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, dict) and item.get("prompt") and item.get("model"):
+                entries.append(item)
+    return entries
+
+
+class CacheWarmer:
+    def __init__(
+        self,
+        cache,
+        engine,
+        concurrency: int = CACHE_WARMUP_CONCURRENCY,
+        rate: float = CACHE_WARMUP_RATE,
+        ready_fraction: float = CACHE_WARMUP_READY_FRACTION,
+    ):
+        self._cache = cache
+        self._engine = engine
+        self._concurrency = concurrency
+        self._rate = rate
+        self._ready_fraction = ready_fraction
+        self._next_regen = 0.0
+        self._next_report = 0.1
+        self._started = 0.0
+        self.ready = asyncio.Event()
+        self.total = 0
+        self.done = 0
+        self.imported = 0        # Written from the corpus' own response
+        self.already_cached = 0
+        self.regenerated = 0
+        self.failed = 0
+        self.skipped = 0         # Missing and regeneration disabled
+
+    @property
+    def warm(self) -> int:
+        return self.imported + self.already_cached + self.regenerated
+
+    async def run(self, entries: List[dict]) -> None:
+        self.total = len(entries)
+        self._started = time.monotonic()
+        self._check_ready()
+        queue: asyncio.Queue = asyncio.Queue()
+        for entry in entries:
+            queue.put_nowait(entry)
+
+        async def worker() -> None:
+            while not queue.empty():
+                await self._warm(queue.get_nowait())
+                self.done += 1
+                self._check_ready()
+                self._report()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, self._concurrency))))
+        finally:
+            self.ready.set()  # Never hold startup past the end of the run
+
+    async def wait_ready(self, timeout: float = CACHE_WARMUP_READY_TIMEOUT) -> bool:
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _warm(self, entry: dict) -> None:
+        prompt, model = entry["prompt"], entry["model"]
+        max_tokens = int(entry.get("max_tokens", 1024))
+        temperature = float(entry.get("temperature", 0.7))
+        path = self._engine.completion_path  # Warm the keys /complete reads
+        try:
+            if entry.get("response"):
+                await self._cache.set(
+                    prompt, entry["response"], model, max_tokens, temperature, force=True, path=path
+                )
+                self.imported += 1
+                return
+            # Loads the in-process tier on a Redis hit
+            if await self._cache.get(prompt, model, max_tokens, temperature, path=path):
+                self.already_cached += 1
+                return
+            if self._rate <= 0:
+                self.skipped += 1
+                return
+            await self._pace()
+            response = await self._engine.generate(
+                prompt=prompt,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                priority=BACKGROUND_PRIORITY,
+            )
+            await self._cache.set(prompt, response, model, max_tokens, temperature, force=True, path=path)
+            self.regenerated += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1
+
+    async def _pace(self) -> None:
+        """Spread regenerations at most `rate` per second across all workers."""
+        now = time.monotonic()
+        wait = self._next_regen - now
+        self._next_regen = max(now, self._next_regen) + 1 / self._rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _check_ready(self) -> None:
+        if not self.total or self.warm / self.total >= self._ready_fraction:
+            self.ready.set()
+
+    def _report(self) -> None:
+        progress = self.done / self.total
+        if progress < self._next_report and self.done < self.total:
+            return
+        self._next_report = (int(progress * 10) + 1) / 10
+        print(
+            f"🔥 Cache warmup {self.done}/{self.total} "
+            f"(warm {self.warm}, regenerated {self.regenerated}, failed {self.failed}) "
+            f"in {time.monotonic() - self._started:.1f}s"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total,
+            "done": self.done,
+            "warm_fraction": round(self.warm / self.total, 4) if self.total else 1.0,
+            "imported": self.imported,
+            "already_cached": self.already_cached,
+            "regenerated": self.regenerated,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "ready": self.ready.is_set(),
+        }
+
+
+async def _main(path: str, concurrency: int, rate: float) -> None:
+    from app.services.cache import SemanticCache
+    from app.services.inference_engine import InferenceEngine
+    from app.services.redis_client import redis_client
+
+    await redis_client.connect()
+    engine = InferenceEngine()
+    try:
+        warmer = CacheWarmer(SemanticCache(), engine, concurrency, rate)
+        await warmer.run(load_corpus(path))
+        print(json.dumps(warmer.stats(), indent=2))
+    finally:
+        await engine.aclose()
+        await redis_client.disconnect()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Warm the AI response cache from a JSONL corpus")
+    parser.add_argument("corpus", help="JSONL file of hot prompts or exported cache entries")
+    parser.add_argument("--concurrency", type=int, default=CACHE_WARMUP_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=CACHE_WARMUP_RATE,
+                        help="upstream regenerations per second (0 = only import/check)")
+    args = parser.parse_args()
+    asyncio.run(_main(args.corpus, args.concurrency, args.rate))